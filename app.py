@@ -1,6 +1,7 @@
-import os, base64
+import os, sys, base64, hashlib, json, pickle, shutil, sqlite3, threading, time
+from collections import OrderedDict, namedtuple
 from functools import wraps
-from flask import request, Response
+from flask import request, Response, jsonify
 from dash import Dash
 
 USERNAME = "admin"
@@ -33,17 +34,24 @@ def apply_basic_auth(flask_server):
 
 import dash
 import dash_bootstrap_components as dbc
-from dash import dcc, html, Input, Output, State, dash_table
+from dash import dcc, html, Input, Output, State, Patch, dash_table
+from dash.exceptions import PreventUpdate
 import plotly.express as px
 import plotly.graph_objects as go
 import pandas as pd
 import numpy as np
+import operator
 import re
-from datetime import datetime
+from datetime import datetime, timedelta
 from dash.dcc import send_bytes
 from dash.dash_table import FormatTemplate
 from dash.dash_table.Format import Format, Group, Scheme
 
+try:
+    import pyarrow.feather as feather
+except ImportError:  # cache is optional; fall back to reading Excel
+    feather = None
+
 
 
 # NOTE: The full dashboard code is extremely long.
@@ -57,6 +65,17 @@ SUMMARY_SHEET = "Summary"
 CRIT_SHEET = "Stock Criticality_Days"
 COORD_SHEET = "Coordinates"
 
+DEPLETION_DATE_FORMATS = [
+    "%d-%b-%Y",
+    "%d-%b-%y",
+    "%d-%b",
+    "%Y-%m-%d",
+    "%d/%m/%Y",
+    "%d/%m/%y",
+    "%Y/%m/%d",
+]
+
+
 def parse_depletion_date(x):
     if pd.isna(x):
         return pd.NaT
@@ -64,16 +83,7 @@ def parse_depletion_date(x):
         return pd.to_datetime(x)
 
     s = str(x).strip()
-    fmts = [
-        "%d-%b-%Y",
-        "%d-%b-%y",
-        "%d-%b",
-        "%Y-%m-%d",
-        "%d/%m/%Y",
-        "%d/%m/%y",
-        "%Y/%m/%d",
-    ]
-    for f in fmts:
+    for f in DEPLETION_DATE_FORMATS:
         try:
             dt = datetime.strptime(s, f)
             if f == "%d-%b":
@@ -88,6 +98,46 @@ def parse_depletion_date(x):
         return pd.NaT
 
 
+def parse_depletion_dates(values):
+    # Column-wide parse_depletion_date: dates repeat heavily, so only the
+    # distinct strings are parsed, one pd.to_datetime pass per format, each
+    # pass only seeing the strings the earlier formats did not match.
+    values = pd.Series(values)
+    codes, uniques = pd.factorize(values)
+    uniques = np.asarray(uniques, dtype=object)
+    parsed = np.full(len(uniques), np.datetime64("NaT"), dtype="datetime64[ns]")
+
+    is_dt = np.array(
+        [isinstance(u, (pd.Timestamp, datetime)) for u in uniques], dtype=bool
+    )
+    if is_dt.any():
+        parsed[is_dt] = pd.to_datetime(pd.Series(uniques[is_dt])).to_numpy()
+
+    pending = pd.Series(uniques[~is_dt], index=np.flatnonzero(~is_dt), dtype=object)
+    pending = pending.astype(str).str.strip()
+    for f in DEPLETION_DATE_FORMATS:
+        if pending.empty:
+            break
+        dt = pd.to_datetime(pending, format=f, errors="coerce")
+        if f == "%d-%b":
+            year = datetime.today().year
+            dt = dt.map(lambda d: d.replace(year=year), na_action="ignore")
+        hit = dt.notna().to_numpy()
+        parsed[pending.index[hit]] = dt[hit].to_numpy()
+        pending = pending[~hit]
+
+    # whatever is left goes through the same per-value fallback as before
+    for i, s in pending.items():
+        dt = pd.to_datetime(s, dayfirst=True, errors="coerce")
+        if not pd.isna(dt):
+            parsed[i] = dt.to_datetime64()
+
+    out = np.full(len(values), np.datetime64("NaT"), dtype="datetime64[ns]")
+    found = codes >= 0
+    out[found] = parsed[codes[found]]
+    return pd.Series(out, index=values.index)
+
+
 def explode_interrotation(df):
     records = []
     for _, row in df.iterrows():
@@ -111,11 +161,144 @@ def explode_interrotation(df):
     return pd.DataFrame(records)
 
 
+# InterRotation is parsed once per load into a long table, one row per donor
+# token: (row_id into df_full, Branch, Cases), ordered by row.  Each distinct
+# string is parsed once and the result repeated for every row holding it.
+# Same reading as explode_interrotation: comma-separated tokens, each matched
+# as "<name> (<digits> CS)" from its first non-blank character.
+INTER_ROTATION_TOKEN = r"(?:^|,)\s*([^\s,][^,\n]*?)\s*\((\d+)\s*CS\)"
+
+
+def build_inter_rotation(values):
+    codes, uniques = pd.factorize(values)
+    parsed = pd.Series(np.asarray(uniques, dtype=object), dtype=object).str.extractall(
+        INTER_ROTATION_TOKEN
+    )
+    uid = parsed.index.get_level_values(0).to_numpy()
+    names, branches = pd.factorize(parsed[0])
+    cases = parsed[1].to_numpy(dtype=np.int64)
+
+    # entry ids per row: starts[code] + 0..count-1
+    counts = np.bincount(uid, minlength=len(uniques))
+    starts = np.concatenate([[0], np.cumsum(counts)])[:-1]
+    known = codes >= 0
+    per_row = np.where(known, counts[np.where(known, codes, 0)], 0)
+    row_ids = np.repeat(np.arange(len(codes), dtype=np.int32), per_row)
+    first = np.repeat(starts[np.where(known, codes, 0)], per_row)
+    offset = np.arange(len(row_ids)) - np.repeat(np.cumsum(per_row) - per_row, per_row)
+    entry = first + offset
+
+    return pd.DataFrame(
+        {
+            "row_id": row_ids,
+            "Branch": pd.Categorical.from_codes(names[entry], branches),
+            "Cases": cases[entry],
+        }
+    )
+
+
+def inter_rotation_rows(snap, rows):
+    # explode_interrotation(df_full.iloc[rows]), from the load-time table
+    inter = snap.inter
+    in_rows = np.zeros(len(snap.df_full), dtype=bool)
+    in_rows[rows] = True
+    picked = inter[in_rows[inter["row_id"].to_numpy()]]
+    ids = picked["row_id"].to_numpy()
+    if not len(ids):
+        return pd.DataFrame()
+    df_full = snap.df_full
+    return pd.DataFrame(
+        {
+            "SKU": df_full["SKU"].iloc[ids].to_numpy(dtype=object),
+            "Brand": df_full["Brand"].iloc[ids].to_numpy(dtype=object),
+            "Branch": picked["Branch"].to_numpy().astype(object),
+            "Cases": picked["Cases"].to_numpy(),
+        }
+    )
+
+
+# The single-SKU map draws an edge from every donor to every OOS branch.  Past
+# INTER_MAX_EDGES only the best-ranked pairs are drawn: "distance" keeps the
+# nearest (great-circle) pairs, "cases" the pairs from the biggest donors.
+INTER_MAX_EDGES = 500
+INTER_EDGE_RANK = "distance"
+
+
+def great_circle_km(lat1, lon1, lat2, lon2):
+    lat1, lon1, lat2, lon2 = map(np.radians, (lat1, lon1, lat2, lon2))
+    a = (
+        np.sin((lat2 - lat1) / 2) ** 2
+        + np.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2) ** 2
+    )
+    return 2 * 6371.0 * np.arcsin(np.sqrt(a))
+
+
+def inter_edges(
+    d_lat,
+    d_lon,
+    t_lat,
+    t_lon,
+    d_cases=None,
+    rank=INTER_EDGE_RANK,
+    limit=INTER_MAX_EDGES,
+):
+    # donor-major (donor, target) pairs as single lat / lon arrays with a NaN
+    # after every segment, which plotly draws as separate lines
+    d_lat, d_lon, t_lat, t_lon = (
+        np.asarray(a, dtype=float) for a in (d_lat, d_lon, t_lat, t_lon)
+    )
+    donor = np.repeat(np.arange(len(d_lat)), len(t_lat))
+    target = np.tile(np.arange(len(t_lat)), len(d_lat))
+
+    if limit is not None and len(donor) > limit:
+        if rank == "cases" and d_cases is not None:
+            key = -np.asarray(d_cases, dtype=float)[donor]
+        else:
+            key = great_circle_km(
+                d_lat[donor], d_lon[donor], t_lat[target], t_lon[target]
+            )
+        keep = np.sort(np.argsort(key, kind="stable")[:limit])
+        donor, target = donor[keep], target[keep]
+
+    gap = np.full(len(donor), np.nan)
+    lats = np.column_stack([d_lat[donor], t_lat[target], gap]).ravel()
+    lons = np.column_stack([d_lon[donor], t_lon[target], gap]).ravel()
+    return lats, lons
+
+
 def normalize_branch(x):
     return str(x).strip().replace("–", "-").upper()
 
+# flag column, source column, lower-cased values that set the flag
+FLAG_SPECS = [
+    ("IsOOS", "OOS", ["oos", "yes", "true"]),
+    ("IsRisk", "Risk", ["risk", "yes", "true"]),
+    ("IsLowCover", "DaysLess10", ["yes", "true"]),
+    ("IsBackorder", "BackOrder", ["yes", "true"]),
+    ("IsOversell", "Oversell", ["yes", "true"]),
+]
+
+
+def derive_flag(values, truthy):
+    # evaluated on the distinct strings only, then broadcast back by code
+    codes, uniques = pd.factorize(values)
+    hits = pd.Index(uniques).astype(str).str.lower().isin(truthy).astype(np.int8)
+    out = np.zeros(len(codes), dtype=np.int8)
+    found = codes >= 0
+    out[found] = hits[codes[found]]
+    return out
+
+
+def days_to_depletion(parsed):
+    days = (parsed - pd.to_datetime(datetime.today().date())).dt.days
+    return days.astype(np.float32)
+
+
 def load_summary(path=FILE_PATH, sheet=SUMMARY_SHEET):
-    df = pd.read_excel(path, sheet_name=sheet, dtype=str)
+    return prepare_summary(pd.read_excel(path, sheet_name=sheet, dtype=str))
+
+
+def prepare_summary(df):
     df = df.fillna("")
 
     col_map = {
@@ -158,27 +341,12 @@ def load_summary(path=FILE_PATH, sheet=SUMMARY_SHEET):
     )
 
     # flags
-    df["IsOOS"] = df["OOS"].apply(
-        lambda x: 1 if str(x).lower() in ["oos", "yes", "true"] else 0
-    )
-    df["IsRisk"] = df["Risk"].apply(
-        lambda x: 1 if str(x).lower() in ["risk", "yes", "true"] else 0
-    )
-    df["IsLowCover"] = df["DaysLess10"].apply(
-        lambda x: 1 if str(x).lower() in ["yes", "true"] else 0
-    )
-    df["IsBackorder"] = df["BackOrder"].apply(
-        lambda x: 1 if str(x).lower() in ["yes", "true"] else 0
-    )
-    df["IsOversell"] = df["Oversell"].apply(
-        lambda x: 1 if str(x).lower() in ["yes", "true"] else 0
-    )
+    for flag, source, truthy in FLAG_SPECS:
+        df[flag] = derive_flag(df[source], truthy)
 
-    df["DepletionDate_parsed"] = df["DepletionDate"].apply(parse_depletion_date)
+    df["DepletionDate_parsed"] = parse_depletion_dates(df["DepletionDate"])
     df["UpcomingPlan_parsed"] = pd.to_datetime(df["UpcomingPlan"], errors="coerce")
-    df["DaysToDepletion"] = (
-        df["DepletionDate_parsed"] - pd.to_datetime(datetime.today().date())
-    ).dt.days
+    df["DaysToDepletion"] = days_to_depletion(df["DepletionDate_parsed"])
 
     return df
 
@@ -187,30 +355,1273 @@ def load_criticality(path=FILE_PATH, sheet=CRIT_SHEET):
     return pd.read_excel(path, sheet_name=sheet)
 
 
+CRIT_BASE_COLUMNS = ["AI_SKU", "AI_MFGBRND"]
+
+
+def prepare_criticality(df_crit):
+    # branch columns hold whole days of cover; blanks stay NaN
+    df_crit = df_crit.copy()
+    for col in df_crit.columns:
+        if col not in CRIT_BASE_COLUMNS:
+            df_crit[col] = (
+                pd.to_numeric(df_crit[col], errors="coerce").round(0).astype(np.float32)
+            )
+    return df_crit
+
+
 def load_coordinates(path=FILE_PATH, sheet=COORD_SHEET):
     df = pd.read_excel(path, sheet_name=sheet)
     return df.dropna(subset=["Latitude", "Longitude"])
 
 
-df_full = load_summary()
-df_crit = load_criticality()
-df_coord = load_coordinates()
+# ---- Filter index
+# Built once per snapshot: for every filterable dimension, each row's value
+# code plus the row ids of every value grouped together (postings).  A filter
+# state is evaluated as OR within a dimension and AND across dimensions on
+# boolean row masks; only the final row ids are used to project df_full.
+Postings = namedtuple("Postings", ["values", "codes", "order", "offsets"])
+
+FILTER_DIMENSIONS = {
+    "brand": "Brand",
+    "plant": "Plant",
+    "branch": "Branch",
+    "class": "Class",
+    "bu": "BusinessUnit",
+    "sku": "SKU",
+}
+DC_BANDS = [("0", None, 0), ("1-4", 1, 4), ("5-6", 5, 6), ("7-10", 7, 10)]
+# SKU / Brand / BusinessUnit / Branch / Plant / Class
+SEARCH_DIMENSIONS = ["sku", "brand", "bu", "branch", "plant", "class"]
+
+
+def read_only(*arrays):
+    # snapshot arrays are shared between threads and, when gunicorn preloads
+    # the app, between forked workers; nothing may write to them
+    for a in arrays:
+        a.flags.writeable = False
+    return arrays
+
+
+def build_postings(values, codes):
+    codes = np.asarray(codes, dtype=np.int32)
+    order = np.argsort(codes, kind="stable")
+    order = order[np.count_nonzero(codes < 0):]  # rows without a value sort first
+    counts = np.bincount(codes[codes >= 0], minlength=len(values))
+    offsets = np.concatenate([[0], np.cumsum(counts)])
+    read_only(codes, order, offsets)
+    return Postings(pd.Index(values), codes, order, offsets)
+
+
+def dc_band_codes(days):
+    days = np.asarray(days, dtype=float)
+    codes = np.full(len(days), -1, dtype=np.int32)
+    for code, (_, low, high) in enumerate(DC_BANDS):
+        in_band = days <= high if low is None else (days >= low) & (days <= high)
+        codes[in_band] = code
+    return codes
+
+
+def build_filter_index(df):
+    index = {
+        dim: build_postings(df[col].cat.categories, df[col].cat.codes)
+        for dim, col in FILTER_DIMENSIONS.items()
+    }
+    index["oversell"] = build_postings(["No", "Yes"], df["IsOversell"])
+    index["risk"] = build_postings(["No", "Yes"], df["IsRisk"])
+    index["dc"] = build_postings(
+        [label for label, _, _ in DC_BANDS], dc_band_codes(df["DaysToDepletion"])
+    )
+    return index
+
+
+def postings_mask(postings, codes):
+    n = len(postings.codes)
+    codes = np.unique(np.asarray(codes, dtype=np.int64))
+    codes = codes[codes >= 0]
+    if len(codes) > 64:
+        # many values: one gather over the row codes beats scattering postings
+        hit = np.zeros(len(postings.values) + 1, dtype=bool)
+        hit[codes] = True
+        return hit[postings.codes]
+    mask = np.zeros(n, dtype=bool)
+    for c in codes:
+        mask[postings.order[postings.offsets[c]:postings.offsets[c + 1]]] = True
+    return mask
+
+
+def value_mask(postings, values):
+    return postings_mask(postings, postings.values.get_indexer(list(values)))
+
+
+FACET_DIMENSIONS = ["brand", "plant", "branch", "class", "bu", "sku"]
+
+
+def facet_counts(snap, masks, dims=FACET_DIMENSIONS):
+    # Leave-one-out facets in one pass: each dimension's options are counted
+    # under every *other* active mask.  Prefix/suffix ANDs over the active
+    # masks give each leave-one-out mask for a single extra AND.
+    active = list(masks)
+    prefix = [None]
+    for d in active:
+        prefix.append(masks[d] if prefix[-1] is None else prefix[-1] & masks[d])
+    suffix = [None]
+    for d in reversed(active):
+        suffix.append(masks[d] if suffix[-1] is None else suffix[-1] & masks[d])
+    suffix.reverse()
+
+    facets = {}
+    for dim in dims:
+        if dim in masks:
+            i = active.index(dim)
+            before, after = prefix[i], suffix[i + 1]
+        else:
+            before, after = prefix[-1], None
+        if before is None:
+            mask = after
+        elif after is None:
+            mask = before
+        else:
+            mask = before & after
+
+        postings = snap.index[dim]
+        codes = postings.codes if mask is None else postings.codes[mask]
+        facets[dim] = np.bincount(codes[codes >= 0], minlength=len(postings.values))
+    return facets
+
+
+# ---- Dropdown search
+# SKU and Branch lists can be huge, so their dropdowns are searched on the
+# server: a sorted lower-cased copy of the values answers prefix queries by
+# binary search, with a substring scan only when prefixes run short.
+SearchIndex = namedtuple("SearchIndex", ["lower", "sorted_lower", "order"])
+
+SEARCH_DROPDOWNS = ["branch", "sku"]
+MAX_SEARCH_RESULTS = 50
+
+
+def build_search_index(values):
+    lower = np.array([str(v).lower() for v in values], dtype=str)
+    order = np.argsort(lower, kind="stable")
+    return SearchIndex(*read_only(lower, lower[order], order))
+
+
+def search_codes(search, text, allowed=None, limit=MAX_SEARCH_RESULTS):
+    # prefix matches first, then substring matches, each in option order
+    q = text.strip().lower()
+    lo = np.searchsorted(search.sorted_lower, q, side="left")
+    hi = np.searchsorted(search.sorted_lower, q + "\U0010ffff", side="left")
+    prefix = np.sort(search.order[lo:hi])
+    if allowed is not None:
+        prefix = prefix[allowed[prefix]]
+    if len(prefix) >= limit:
+        return prefix[:limit]
+
+    contains = np.flatnonzero(np.char.find(search.lower, q) >= 0)
+    if allowed is not None:
+        contains = contains[allowed[contains]]
+    contains = np.setdiff1d(contains, prefix, assume_unique=True)
+    return np.concatenate([prefix, contains])[:limit]
+
+
+# ---- Global search index
+# Trigram inverted index over the distinct values of the search columns.  Each
+# value gets a global id (dimensions laid end to end); a query intersects the
+# posting lists of its trigrams, confirms the literal substring on the few
+# candidates, and the matching value codes are mapped to rows via postings.
+TextIndex = namedtuple("TextIndex", ["lower", "offsets", "grams"])
+
+NO_IDS = np.array([], dtype=np.int32)
+
+
+def trigrams(text):
+    return {text[i:i + 3] for i in range(len(text) - 2)}
+
+
+def build_text_index(index, dims=SEARCH_DIMENSIONS):
+    lower = []
+    offsets = {}
+    for dim in dims:
+        values = [str(v).lower() for v in index[dim].values]
+        offsets[dim] = (len(lower), len(lower) + len(values))
+        lower.extend(values)
+
+    grams = {}
+    for gid, text in enumerate(lower):
+        for g in trigrams(text):
+            grams.setdefault(g, []).append(gid)
+    grams = {g: np.array(ids, dtype=np.int32) for g, ids in grams.items()}
+    lower = np.array(lower, dtype=str)
+    read_only(lower, *grams.values())
+    return TextIndex(lower, offsets, grams)
+
+
+def text_search(text_index, query):
+    # literal, case-insensitive substring match -> {dim: matching value codes}
+    q = query.strip().lower()
+    if len(q) < 3:
+        ids = np.flatnonzero(np.char.find(text_index.lower, q) >= 0)
+    else:
+        lists = sorted(
+            (text_index.grams.get(g, NO_IDS) for g in trigrams(q)), key=len
+        )
+        ids = lists[0]
+        for other in lists[1:]:
+            if not len(ids):
+                break
+            ids = np.intersect1d(ids, other, assume_unique=True)
+        if len(q) > 3 and len(ids):
+            ids = ids[np.char.find(text_index.lower[ids], q) >= 0]
+
+    return {
+        dim: ids[(ids >= start) & (ids < end)] - start
+        for dim, (start, end) in text_index.offsets.items()
+    }
+
+
+# ---- Information and criticality tables
+# Both tables page, sort and filter on the server so a callback only ever
+# ships one page.  Every table column gets a dense rank per row (sorted
+# distinct values plus codes, -1 for blanks): sorting is an argsort of small
+# ints and a filter_query clause is evaluated once per distinct value.
+INFO_COLUMNS = {
+    "executive": [
+        {"name": "Plant", "id": "Plant", "type": "text"},
+        {"name": "SKU", "id": "SKU", "type": "text"},
+        {"name": "Brand", "id": "Brand", "type": "text"},
+        {"name": "BusinessUnit", "id": "BusinessUnit", "type": "text"},
+        {"name": "Branch", "id": "Branch", "type": "text"},
+        {"name": "Class", "id": "Class", "type": "text"},
+        {"name": "OOS", "id": "OOS", "type": "text"},
+        {"name": "Risk", "id": "Risk", "type": "text"},
+        {
+            "name": "Balance Supply",
+            "id": "BalanceSupply",
+            "type": "numeric",
+            "format": Format(group=Group.yes, scheme=Scheme.fixed, precision=0),
+        },
+        {"name": "Upcoming Plan", "id": "UpcomingPlan", "type": "text"},
+        {"name": "Depletion Date", "id": "DepletionDate", "type": "text"},
+    ],
+    "analyst": [
+        {"name": "Plant", "id": "Plant", "type": "text"},
+        {"name": "SKU", "id": "SKU", "type": "text"},
+        {"name": "Brand", "id": "Brand", "type": "text"},
+        {"name": "BusinessUnit", "id": "BusinessUnit", "type": "text"},
+        {"name": "Branch", "id": "Branch", "type": "text"},
+        {"name": "Class", "id": "Class", "type": "text"},
+        {"name": "Days<10", "id": "DaysLess10", "type": "text"},
+        {"name": "OOS", "id": "OOS", "type": "text"},
+        {
+            "name": "PlantInv %",
+            "id": "PlantInvPerc",
+            "type": "numeric",
+            "format": FormatTemplate.percentage(1),
+        },
+        {"name": "Oversell", "id": "Oversell", "type": "text"},
+        {"name": "Risk", "id": "Risk", "type": "text"},
+        {
+            "name": "MTD Sales",
+            "id": "MTD_Sales",
+            "type": "numeric",
+            "format": Format(group=Group.yes, scheme=Scheme.fixed, precision=0),
+        },
+        {
+            "name": "Forecast",
+            "id": "Forecast",
+            "type": "numeric",
+            "format": Format(group=Group.yes, scheme=Scheme.fixed, precision=0),
+        },
+        {
+            "name": "Avg 3M Sales",
+            "id": "Avg_3MNTH_sales",
+            "type": "numeric",
+            "format": Format(group=Group.yes, scheme=Scheme.fixed, precision=0),
+        },
+        {
+            "name": "Balance Supply",
+            "id": "BalanceSupply",
+            "type": "numeric",
+            "format": Format(group=Group.yes, scheme=Scheme.fixed, precision=0),
+        },
+        {"name": "Upcoming Plan", "id": "UpcomingPlan", "type": "text"},
+        {"name": "Depletion Date", "id": "DepletionDate", "type": "text"},
+    ],
+}
+# shown as plain dates, taken from the parsed column
+INFO_DATE_COLUMNS = {
+    "UpcomingPlan": "UpcomingPlan_parsed",
+    "DepletionDate": "DepletionDate_parsed",
+}
+INFO_PAGE_SIZE = 15
+
+
+def display_decimals(fmt):
+    # decimals a column format shows, in stored units (a percentage is x100)
+    spec = re.search(r"\.(\d+)([f%])", fmt.to_plotly_json()["specifier"])
+    return int(spec[1]) + (2 if spec[2] == "%" else 0)
+
+
+# measures are stored as float32; records (page JSON and export) go out as
+# float64 rounded to what the table shows, without the float32 noise
+INFO_DECIMALS = {
+    c["id"]: display_decimals(c["format"])
+    for cols in INFO_COLUMNS.values()
+    for c in cols
+    if "format" in c
+}
+
+TableColumn = namedtuple("TableColumn", ["codes", "values"])
+
+# "{Col} op value" as written by DataTable's filter row; i/s = case flag
+FILTER_CLAUSE = re.compile(
+    r"\{(?P<column>[^}]+)\}\s+"
+    r"(?:(?P<unary>is (?:blank|nil))"
+    r"|(?P<case>[is])?(?P<op>contains|datestartswith|eq|ne|lt|le|gt|ge|!=|<=|>=|=|<|>)"
+    r"\s+(?P<value>.*))$"
+)
+FILTER_OPERATORS = {"=": "eq", "!=": "ne", "<": "lt", "<=": "le", ">": "gt", ">=": "ge"}
+
+
+def info_columns(view_mode):
+    return INFO_COLUMNS["executive" if view_mode == "executive" else "analyst"]
+
+
+def smallest_int(codes, n_values):
+    for dtype in (np.int8, np.int16, np.int32):
+        if n_values < np.iinfo(dtype).max:
+            return codes.astype(dtype, copy=False)
+    return codes
+
+
+def build_table_column(values):
+    if isinstance(values.dtype, pd.CategoricalDtype):
+        # categories are sorted by apply_schema / astype("category")
+        codes, uniques = values.cat.codes.to_numpy(), values.cat.categories
+    else:
+        codes, uniques = pd.factorize(values, sort=True)
+    if isinstance(uniques, pd.DatetimeIndex):
+        uniques = uniques.strftime("%Y-%m-%d")
+    uniques = np.asarray(uniques)
+    codes = smallest_int(codes, len(uniques))
+    read_only(codes, uniques)
+    return TableColumn(codes, uniques)
+
+
+def build_table_index(df_full, df_crit):
+    ids = {c["id"] for cols in INFO_COLUMNS.values() for c in cols}
+    return {
+        "info": {
+            col: build_table_column(df_full[INFO_DATE_COLUMNS.get(col, col)])
+            for col in ids
+            if INFO_DATE_COLUMNS.get(col, col) in df_full
+        },
+        "crit": {col: build_table_column(df_crit[col]) for col in df_crit.columns},
+    }
+
+
+def parse_filter_value(text):
+    text = text.strip()
+    if len(text) > 1 and text[0] == text[-1] and text[0] in "\"'`":
+        return text[1:-1].replace("\\" + text[0], text[0])
+    return text
+
+
+def clause_hits(column, clause):
+    # one bool per distinct value (+ one for blank rows)
+    values = column.values
+    if clause["unary"]:
+        # Dash treats "" as blank too; text columns keep it as a category
+        blank = pd.Index(values).astype(str).str.strip() == ""
+        return np.append(np.asarray(blank, dtype=bool), True)
+
+    op = FILTER_OPERATORS.get(clause["op"], clause["op"])
+    value = parse_filter_value(clause["value"])
+    if op in ("contains", "datestartswith") or values.dtype.kind not in "iuf":
+        text = pd.Index(values).astype(str)
+        if clause["case"] == "i":
+            text, value = text.str.lower(), value.lower()
+        if op == "contains":
+            hits = text.str.contains(value, regex=False)
+        elif op == "datestartswith":
+            hits = text.str.startswith(value)
+        else:
+            hits = getattr(operator, op)(text, value)
+    else:
+        try:
+            hits = getattr(operator, op)(values, float(value))
+        except ValueError:
+            hits = np.full(len(values), op == "ne")
+    return np.append(np.asarray(hits, dtype=bool), False)
+
+
+def table_filter(table, rows, filter_query):
+    for part in (filter_query or "").split(" && "):
+        clause = FILTER_CLAUSE.match(part.strip())
+        if clause is None or clause["column"] not in table:
+            continue  # unknown clause: leave the rows as they are
+        column = table[clause["column"]]
+        rows = rows[clause_hits(column, clause)[column.codes[rows]]]
+    return rows
+
+
+def table_sort(table, rows, sort_by):
+    keys = []
+    for spec in reversed(sort_by or []):  # lexsort: last key is primary
+        column = table.get(spec["column_id"])
+        if column is None:
+            continue
+        key = column.codes[rows]
+        last = len(column.values)
+        if spec["direction"] == "desc":
+            key = np.where(key < 0, last, last - 1 - key)
+        else:
+            key = np.where(key < 0, last, key)
+        keys.append(key)
+    if not keys:
+        return rows
+    if len(keys) == 1:
+        return rows[np.argsort(keys[0], kind="stable")]
+    return rows[np.lexsort(keys)]
+
+
+CRIT_PAGE_SIZE = 15
+# branch columns sent per page; the rest are reached with the column pager
+CRIT_COLUMN_WINDOW = 30
+
+
+# bands: 0 = deep red, 1–2 dark red, 3–4 bright red, 5–6 light red, 7–8 pale green, 9–10 green, >10 dark green
+CRIT_BANDS = [
+    (0, 0, "#B71C1C", "white"),
+    (1, 2, "#D32F2F", "white"),
+    (3, 4, "#F44336", "white"),
+    (5, 6, "#FFCDD2", "#212121"),
+    (7, 8, "#FFFDE7", "#212121"),
+    (9, 10, "#C8E6C9", "#212121"),
+    (11, 9999, "#2E7D32", "white"),
+]
+CRIT_BLANK = len(CRIT_BANDS)  # band code of an empty cell
+CRIT_BAND_COLORS = [(bg, font) for _, _, bg, font in CRIT_BANDS] + [
+    ("#ECEFF1", "#90A4AE")
+]
+
+# The criticality sheet as a dense rows x branches float32 matrix, with each
+# row's SKU / brand and each column's branch mapped to df_full's category
+# codes (-1 = not in the summary), and a band code per cell (-1 = no band).
+CritMatrix = namedtuple(
+    "CritMatrix",
+    [
+        "skus",
+        "brands",
+        "branches",
+        "values",
+        "bands",
+        "sku_codes",
+        "brand_codes",
+        "branch_codes",
+    ],
+)
+
+
+def crit_band_codes(values):
+    bands = np.full(values.shape, -1, dtype=np.int8)
+    for code, (low, high, _, _) in enumerate(CRIT_BANDS):
+        bands[(values >= low) & (values <= high)] = code
+    bands[np.isnan(values)] = CRIT_BLANK
+    return bands
+
+
+def build_crit_matrix(df_crit, df_full):
+    branches = pd.Index([c for c in df_crit.columns if c not in CRIT_BASE_COLUMNS])
+    values = np.ascontiguousarray(df_crit[branches].to_numpy(dtype=np.float32))
+    skus = df_crit["AI_SKU"].to_numpy(dtype=object)
+    brands = df_crit["AI_MFGBRND"].to_numpy(dtype=object)
+    crit = CritMatrix(
+        skus=skus,
+        brands=brands,
+        branches=branches,
+        values=values,
+        bands=crit_band_codes(values),
+        sku_codes=df_full["SKU"].cat.categories.get_indexer(skus),
+        brand_codes=df_full["Brand"].cat.categories.get_indexer(brands),
+        branch_codes=df_full["Branch"].cat.categories.get_indexer(branches),
+    )
+    read_only(*crit[3:])
+    return crit
+
+
+def crit_frame(df_crit, crit):
+    # df_crit with its branch columns viewing the matrix, so the cells are
+    # held once
+    cells = pd.DataFrame(crit.values, columns=crit.branches, index=df_crit.index, copy=False)
+    return pd.concat([df_crit[CRIT_BASE_COLUMNS], cells], axis=1, copy=False)
+
+
+def present_values(postings, rows):
+    # bool per value of a dimension (+ False for "-1") over the given rows
+    codes = postings.codes[rows]
+    seen = np.zeros(len(postings.values) + 1, dtype=bool)
+    seen[codes[codes >= 0]] = True
+    return seen
+
+
+def crit_page_styles(crit, rows, cols):
+    # one rule per (page row, band) listing its columns, so the rule count is
+    # bounded by page size x bands however many branches are on screen
+    names = crit.branches[cols]
+    styles = []
+    for i, row in enumerate(crit.bands[np.ix_(rows, cols)]):
+        for code in np.unique(row):
+            if code < 0:
+                continue
+            bg, font = CRIT_BAND_COLORS[code]
+            styles.append(
+                {
+                    "if": {
+                        "row_index": i,
+                        "column_id": names[row == code].tolist(),
+                    },
+                    "backgroundColor": bg,
+                    "color": font,
+                }
+            )
+    return styles
+
+
+def crit_records(crit, rows, cols):
+    # whole days, None for blanks
+    values = crit.values[np.ix_(rows, cols)]
+    cells = np.where(np.isnan(values), None, np.nan_to_num(values).astype(np.int64))
+    table = np.column_stack([crit.skus[rows], crit.brands[rows], cells])
+    names = CRIT_BASE_COLUMNS + crit.branches[cols].tolist()
+    return [dict(zip(names, row)) for row in table.tolist()]
+
+
+def info_records(snap, rows, columns):
+    ids = [c["id"] for c in columns]
+    page = snap.df_full.iloc[rows]
+    out = page[ids].copy()
+    for col, parsed in INFO_DATE_COLUMNS.items():
+        if col in out:
+            out[col] = page[parsed].dt.date
+    for col, decimals in INFO_DECIMALS.items():
+        if col in out:
+            out[col] = out[col].astype(np.float64).round(decimals)
+    return out.to_dict("records")
+
+
+# ---- SKU x Plant OOS gap cube
+# The OOS gap is computed per SKU x Plant over the filtered rows: supply is
+# summed, plant inventory is the max, and the gap (supply - inventory,
+# clipped at 0) is handed back to the rows in proportion to their supply.
+# The pair and (pair, Brand) keys and the float64 measures are fixed per load,
+# so under any filter the gap is a few masked bincounts over integer keys.
+# The per-row weights depend on the filtered pair totals (a Branch or Class
+# filter can split a pair), so they are derived per filter state, not stored.
+OosCube = namedtuple(
+    "OosCube",
+    [
+        "pair",
+        "pair_sku",
+        "pair_plant",
+        "trio",
+        "trio_pair",
+        "trio_brand",
+        "supply",
+        "plant_inv",
+    ],
+)
+OosGap = namedtuple(
+    "OosGap", ["supply", "plant_inv", "oos", "row_weight", "trios"]
+)
+
+
+def build_oos_cube(df_full):
+    sku = df_full["SKU"].cat.codes.to_numpy().astype(np.int64)
+    plant = df_full["Plant"].cat.codes.to_numpy().astype(np.int64)
+    brand = df_full["Brand"].cat.codes.to_numpy().astype(np.int64)
+
+    # pair ids in (SKU, Plant) code order, as groupby(observed=True) sorts them
+    pair_key = sku * (len(df_full["Plant"].cat.categories) + 1) + plant
+    pair_keys, pair = np.unique(pair_key, return_inverse=True)
+    first = np.zeros(len(pair_keys), dtype=np.int64)
+    first[pair[::-1]] = np.arange(len(pair))[::-1]
+
+    # (pair, Brand) ids by pair, then by first appearance within the pair
+    trio_key = pair * (len(df_full["Brand"].cat.categories) + 1) + brand
+    trio_keys, trio_first = np.unique(trio_key, return_index=True)
+    trio_pair = pair[trio_first]
+    order = np.lexsort((trio_first, trio_pair))
+    trio = np.empty(len(trio_keys), dtype=np.int32)
+    trio[order] = np.arange(len(trio_keys), dtype=np.int32)
+    trio_first = trio_first[order]
+
+    pair = pair.astype(np.int32)
+    trio = trio[np.searchsorted(trio_keys, trio_key)]
+    supply = df_full["BalanceSupply"].to_numpy(dtype=np.float64, na_value=0.0)
+    plant_inv = df_full["Total_SKU_Plant_Inventory"].to_numpy(
+        dtype=np.float64, na_value=0.0
+    )
+    read_only(pair, trio, supply, plant_inv)
+    return OosCube(
+        pair=pair,
+        pair_sku=df_full["SKU"].iloc[first].to_numpy(dtype=object),
+        pair_plant=df_full["Plant"].iloc[first].to_numpy(dtype=object),
+        trio=trio,
+        trio_pair=trio_pair[order],
+        trio_brand=df_full["Brand"].iloc[trio_first].to_numpy(dtype=object),
+        supply=supply,
+        plant_inv=plant_inv,
+    )
+
+
+def oos_gap(cube, rows):
+    n = len(cube.pair_sku)
+    pair = cube.pair[rows]
+    row_supply = cube.supply[rows]
+    supply = np.bincount(pair, weights=row_supply, minlength=n)
+    plant_inv = np.full(n, np.nan)
+    np.fmax.at(plant_inv, pair, cube.plant_inv[rows])
+    oos = np.clip(supply - plant_inv, 0, None)
+    oos[np.isnan(oos)] = 0
+
+    total = supply[pair]
+    with np.errstate(divide="ignore", invalid="ignore"):
+        row_weight = np.where(total != 0, row_supply / total, 0.0)
+    trios = np.flatnonzero(np.bincount(cube.trio[rows], minlength=len(cube.trio_pair)))
+    return OosGap(supply, plant_inv, oos, row_weight, trios)
+
+
+def gap_by_group(snap, rows, gap, column):
+    # OOS gap allocated to rows, and risk supply, summed per group code
+    codes = snap.df_full[column].cat.codes.to_numpy()[rows]
+    labels = snap.df_full[column].cat.categories
+    known = codes >= 0
+    codes = codes[known]
+    alloc = (gap.row_weight * gap.oos[snap.oos.pair[rows]])[known]
+    risk = snap.df_full["IsRisk"].to_numpy()[rows][known] == 1
+    supply = snap.oos.supply[rows][known]
+
+    n = len(labels)
+    oos_cases = np.bincount(codes, weights=alloc, minlength=n)
+    risk_cases = np.bincount(codes[risk], weights=supply[risk], minlength=n)
+    present = np.flatnonzero(np.bincount(codes, minlength=n))
+    return pd.DataFrame(
+        {
+            column: np.asarray(labels, dtype=object)[present],
+            "OOS_Cases": oos_cases[present],
+            "Risk_Cases": risk_cases[present],
+        }
+    )
+
+
+# ---- KPI engine
+# Every KPI card is a reduction over the filtered row numbers: distinct SKU
+# codes, summed supply, the four flag counts and the total OOS gap.  The flags
+# are held as one (rows x 4) int8 matrix so they reduce in a single pass.
+KPI_FLAGS = ["IsRisk", "IsBackorder", "IsLowCover", "IsOversell"]
+KpiBase = namedtuple("KpiBase", ["sku", "flags"])
+Kpis = namedtuple(
+    "Kpis",
+    ["skus", "balance_supply", "oos_cases", "risk", "backorder", "low_cover", "oversell"],
+)
+
+
+def build_kpi_base(df_full):
+    # SKU codes shifted by one so NaN (-1) lands in bin 0 and is not counted
+    sku = df_full["SKU"].cat.codes.to_numpy().astype(np.int32) + 1
+    flags = np.ascontiguousarray(
+        np.column_stack([df_full[f].to_numpy(dtype=np.int8) for f in KPI_FLAGS])
+    )
+    read_only(sku, flags)
+    return KpiBase(sku, flags)
+
+
+def compute_kpis(snap, rows):
+    base = snap.kpi
+    skus = np.count_nonzero(
+        np.bincount(base.sku[rows], minlength=1)[1:]
+    )
+    risk, backorder, low_cover, oversell = base.flags[rows].sum(axis=0, dtype=np.int64)
+    return Kpis(
+        skus=int(skus),
+        balance_supply=int(snap.oos.supply[rows].sum()),
+        oos_cases=int(oos_gap(snap.oos, rows).oos.sum()),
+        risk=int(risk),
+        backorder=int(backorder),
+        low_cover=int(low_cover),
+        oversell=int(oversell),
+    )
+
+
+def kpi_trend(current, previous):
+    # no arrow until there is an earlier snapshot to compare with
+    if previous is None:
+        return None
+    if current > previous:
+        return "up"
+    if current < previous:
+        return "down"
+    return "flat"
+
+
+# ---- KPI history (optional)
+# With KPI_HISTORY_PATH set, every data load appends its KPI aggregates per
+# (Plant, Brand, BusinessUnit, Branch) to a SQLite file, one partition per
+# day (a later load the same day replaces it), plus that day's unfiltered
+# totals.  Filter states that only use those four dimensions then read their
+# trend and sparkline from the file instead of from old workbooks.  Distinct
+# SKU counts do not add up across groups and are not kept; the OOS gap is
+# stored as allocated under the unfiltered view, which only matches the live
+# card while Branch is unset.
+KPI_HISTORY_PATH = os.environ.get("KPI_HISTORY_PATH")
+KPI_HISTORY_DAYS = int(os.environ.get("KPI_HISTORY_DAYS", "30"))
+KPI_HISTORY_DIMS = {
+    "plant": "Plant",
+    "brand": "Brand",
+    "bu": "BusinessUnit",
+    "branch": "Branch",
+}
+KPI_HISTORY_MEASURES = [
+    "balance_supply",
+    "oos_cases",
+    "risk",
+    "backorder",
+    "low_cover",
+    "oversell",
+]
+# position of each filter dimension in the callback's *filters
+FILTER_POSITIONS = {"brand": 0, "plant": 1, "branch": 2, "bu": 4}
+KpiHistory = namedtuple("KpiHistory", ["days", "values"])
+SPARK_BLOCKS = "▁▂▃▄▅▆▇█"
+
+_history_local = threading.local()
+
+
+def kpi_history_db():
+    # one connection per thread, and never one inherited across a fork
+    conn = getattr(_history_local, "conn", None)
+    if conn is None or _history_local.pid != os.getpid():
+        conn = sqlite3.connect(KPI_HISTORY_PATH, timeout=5, isolation_level=None)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        measures = ", ".join(f"{m} REAL" for m in KPI_HISTORY_MEASURES)
+        # one row per day with the unfiltered totals
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS kpi_days ("
+            f"day TEXT PRIMARY KEY, version TEXT, loaded_at TEXT, {measures})"
+        )
+        # each (Plant, Brand, BusinessUnit, Branch) combination gets a small id
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS kpi_groups ("
+            "id INTEGER PRIMARY KEY, plant TEXT, brand TEXT, bu TEXT, branch TEXT, "
+            "UNIQUE (plant, brand, bu, branch))"
+        )
+        # keyed by group first, so a filter state reads its groups' day ranges
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS kpi_history ("
+            f"group_id INTEGER, day TEXT, {measures}, "
+            "PRIMARY KEY (group_id, day)) WITHOUT ROWID"
+        )
+        _history_local.conn, _history_local.pid = conn, os.getpid()
+    return conn
+
+
+def kpi_history_groups(snap):
+    df_full = snap.df_full
+    gap = oos_gap(snap.oos, np.arange(len(df_full)))
+    flags = snap.kpi.flags
+    groups = pd.DataFrame(
+        {
+            **{dim: df_full[col] for dim, col in KPI_HISTORY_DIMS.items()},
+            "balance_supply": snap.oos.supply,
+            "oos_cases": gap.row_weight * gap.oos[snap.oos.pair],
+            **{
+                field: flags[:, i].astype(np.int64)
+                for i, field in enumerate(["risk", "backorder", "low_cover", "oversell"])
+            },
+        }
+    )
+    groups = groups.groupby(
+        list(KPI_HISTORY_DIMS), observed=True, dropna=False
+    ).sum().reset_index()
+    for dim in KPI_HISTORY_DIMS:
+        groups[dim] = groups[dim].astype(object).fillna("").astype(str)
+    return groups
+
+
+def record_kpi_history(snap):
+    if not KPI_HISTORY_PATH:
+        return
+    day = snap.loaded_at.date().isoformat()
+    dims = list(KPI_HISTORY_DIMS)
+    try:
+        db = kpi_history_db()
+        day_version = "SELECT version FROM kpi_days WHERE day = ?"
+        row = db.execute(day_version, (day,)).fetchone()
+        if row is not None and row[0] == snap.version:
+            return
+        groups = kpi_history_groups(snap)
+        keys = list(groups[dims].itertuples(index=False, name=None))
+        measures = groups[KPI_HISTORY_MEASURES]
+        totals = tuple(float(v) for v in measures.sum())
+        db.execute("BEGIN IMMEDIATE")
+        try:
+            # checked again under the write lock: another worker reloading
+            # the same workbook may have recorded it in the meantime
+            row = db.execute(day_version, (day,)).fetchone()
+            if row is not None and row[0] == snap.version:
+                db.execute("ROLLBACK")
+                return
+            db.executemany(
+                "INSERT OR IGNORE INTO kpi_groups (plant, brand, bu, branch) "
+                "VALUES (?, ?, ?, ?)",
+                keys,
+            )
+            ids = {
+                tuple(r[1:]): r[0]
+                for r in db.execute("SELECT id, plant, brand, bu, branch FROM kpi_groups")
+            }
+            if row is not None:
+                # a later load the same day replaces that day's rows; one
+                # primary-key lookup per known group instead of a full scan
+                db.executemany(
+                    "DELETE FROM kpi_history WHERE group_id = ? AND day = ?",
+                    [(gid, day) for gid in ids.values()],
+                )
+            db.executemany(
+                "INSERT INTO kpi_history VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                [
+                    (ids[key], day) + rec
+                    for key, rec in zip(
+                        keys, measures.itertuples(index=False, name=None)
+                    )
+                ],
+            )
+            db.execute(
+                "INSERT OR REPLACE INTO kpi_days VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (day, snap.version, snap.loaded_at.isoformat(timespec="seconds"))
+                + totals,
+            )
+            db.execute("COMMIT")
+        except Exception:
+            db.execute("ROLLBACK")
+            raise
+    except Exception as e:
+        print("KPI HISTORY ERROR:", e)
+
+
+def read_kpi_history(filters, since):
+    # None when the filter state is not expressible in the stored groups
+    brands, plants, branches, classes, busunits, ai_skus, dc, oversell, risk, search = filters
+    if any([classes, ai_skus, dc, oversell, risk, (search or "").strip()]):
+        return None
+    where, params = [], []
+    for dim, pos in FILTER_POSITIONS.items():
+        values = filters[pos]
+        if values:
+            where.append(f"{dim} IN ({', '.join('?' * len(values))})")
+            params.extend(str(v) for v in values)
+    sums = ", ".join(f"SUM({m})" for m in KPI_HISTORY_MEASURES)
+    try:
+        db = kpi_history_db()
+        if not where:
+            rows = db.execute(
+                f"SELECT day, {', '.join(KPI_HISTORY_MEASURES)} FROM kpi_days "
+                "WHERE day >= ? ORDER BY day",
+                (since,),
+            ).fetchall()
+        else:
+            rows = db.execute(
+                f"SELECT day, {sums} FROM kpi_history WHERE group_id IN "
+                f"(SELECT id FROM kpi_groups WHERE {' AND '.join(where)}) "
+                "AND day >= ? GROUP BY day ORDER BY day",
+                params + [since],
+            ).fetchall()
+    except Exception as e:
+        print("KPI HISTORY ERROR:", e)
+        return None
+    # whole numbers, as the cards show them
+    values = {
+        m: [int(r[i + 1]) for r in rows] for i, m in enumerate(KPI_HISTORY_MEASURES)
+    }
+    if branches:
+        # the stored gap is the unfiltered allocation; no like-for-like series
+        values.pop("oos_cases")
+    return KpiHistory([r[0] for r in rows], values)
+
+
+def sparkline(values):
+    if len(values) < 2:
+        return None
+    lo, hi = min(values), max(values)
+    if hi == lo:
+        return SPARK_BLOCKS[0] * len(values)
+    scale = (len(SPARK_BLOCKS) - 1) / (hi - lo)
+    return "".join(SPARK_BLOCKS[int(round((v - lo) * scale))] for v in values)
+
+
+# ---- Data source manager
+# The workbook is watched on every refresh tick; it is only re-parsed when its
+# content actually changed, and the new frames are swapped in as one snapshot.
+DataSnapshot = namedtuple(
+    "DataSnapshot",
+    [
+        "version",
+        "signature",
+        "loaded_at",
+        "df_full",
+        "df_crit",
+        "df_coord",
+        "index",
+        "search",
+        "text",
+        "table",
+        "crit",
+        "inter",
+        "oos",
+        "kpi",
+    ],
+)
+
+_snapshot = None
+_snapshot_lock = threading.Lock()
+# the snapshot this one replaced, cut down to what filtering and the KPIs
+# read, so the KPI cards can show the change since the last data load
+_previous_snapshot = None
+
+
+def previous_version():
+    prev = _previous_snapshot
+    return prev.version if prev is not None else None
+
+
+def kpi_snapshot(snap):
+    return snap._replace(
+        df_full=snap.df_full[[]],
+        df_crit=None,
+        search=None,
+        table=None,
+        crit=None,
+        inter=None,
+    )
+
+
+def file_signature(path=FILE_PATH):
+    st = os.stat(path)
+    return (st.st_mtime_ns, st.st_size)
+
+
+def file_hash(path=FILE_PATH, chunk_size=1 << 20):
+    h = hashlib.sha1()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def load_frames(path=FILE_PATH):
+    df_full = load_summary(path)
+    df_crit = load_criticality(path)
+    df_coord = load_coordinates(path)
+
+    # Normalise names for joins and filters
+    df_full["Branch"] = df_full["Branch"].apply(normalize_branch)
+    df_full["BusinessUnit"] = df_full["BusinessUnit"].str.upper()
+    df_full["Brand"] = df_full["Brand"].str.upper()
+
+    df_crit.rename(columns=lambda x: normalize_branch(x), inplace=True)
+    df_crit["AI_SKU"] = df_crit["AI_SKU"].astype(str)
+    df_crit["AI_MFGBRND"] = df_crit["AI_MFGBRND"].astype(str).str.upper()
+    df_crit = prepare_criticality(df_crit)
+
+    df_full, df_coord = apply_schema(df_full, df_coord)
+    return df_full, df_crit, df_coord
+
+
+# ---- Typed in-memory schema
+# df_full is read as all-strings; dimensions become categoricals (Branch shares
+# one dictionary with the coordinates sheet), measures float32, flags int8.
+SUMMARY_DIMENSIONS = ["Plant", "SKU", "Brand", "BusinessUnit", "Branch", "Class"]
+SUMMARY_MEASURES = [
+    "PlantInvPerc",
+    "MTD_Sales",
+    "Forecast",
+    "Avg_3MNTH_sales",
+    "BalanceSupply",
+    "Total_SKU_Plant_Inventory",
+    "DaysToDepletion",
+]
+# other text columns are stored as categoricals when at least this repetitive
+CATEGORY_MAX_UNIQUE_RATIO = 0.5
+
+
+def apply_schema(df_full, df_coord):
+    df_full = df_full.copy()
+    df_coord = df_coord.copy()
+
+    branches = set(df_full["Branch"]) | set(df_coord["AI_BRANCH"].dropna().astype(str))
+    branch_dtype = pd.CategoricalDtype(sorted(branches))
+    df_full["Branch"] = df_full["Branch"].astype(branch_dtype)
+    df_coord["AI_BRANCH"] = df_coord["AI_BRANCH"].astype(branch_dtype)
+
+    for col in SUMMARY_DIMENSIONS:
+        if col != "Branch":
+            df_full[col] = df_full[col].astype(
+                pd.CategoricalDtype(sorted(df_full[col].unique()))
+            )
+    for col in SUMMARY_MEASURES:
+        if col in df_full:
+            df_full[col] = df_full[col].astype(np.float32)
+    for flag, _, _ in FLAG_SPECS:
+        df_full[flag] = df_full[flag].astype(np.int8)
+
+    limit = CATEGORY_MAX_UNIQUE_RATIO * len(df_full)
+    for col in df_full.columns[df_full.dtypes == object]:
+        if df_full[col].nunique() <= limit:
+            df_full[col] = df_full[col].astype("category")
+
+    return df_full, df_coord
+
+
+def memory_report(before, after):
+    report = pd.DataFrame(
+        {
+            "dtype_before": before.dtypes.astype(str),
+            "bytes_before": before.memory_usage(index=False, deep=True),
+            "dtype_after": after.dtypes.astype(str),
+            "bytes_after": after.memory_usage(index=False, deep=True),
+        }
+    )
+    report.loc["TOTAL", ["bytes_before", "bytes_after"]] = report[
+        ["bytes_before", "bytes_after"]
+    ].sum()
+    return report
+
+
+# ---- Columnar snapshot cache
+# Normalised frames are written once per workbook hash as uncompressed Feather
+# files, which workers memory-map on start-up instead of re-reading Excel.
+# Bump CACHE_SCHEMA whenever load_frames() changes what it produces.
+CACHE_DIR = os.environ.get("DATA_CACHE_DIR", "data/.cache")
+CACHE_SCHEMA = 4
+CACHE_FRAMES = ("summary", "crit", "coord")
+
+
+def cache_prefix(path=FILE_PATH):
+    # DATA_CACHE_DIR may be shared, so entries are named after their workbook
+    stem = os.path.splitext(os.path.basename(path))[0]
+    return re.sub(r"[^\w]+", "_", stem)
+
+
+def cache_key(version, path=FILE_PATH):
+    # "%d-%b" depletion dates are pinned to the current year at parse time
+    return f"{cache_prefix(path)}-{version}-s{CACHE_SCHEMA}-{datetime.today().year}"
+
+
+def stale_cache_entries(key, path=FILE_PATH, cache_dir=CACHE_DIR):
+    # published caches of older versions of this workbook only; temp dirs
+    # and other workbooks' entries belong to someone else
+    published = re.compile(re.escape(cache_prefix(path)) + r"-[0-9a-f]+-s\d+-\d{4}")
+    return [
+        entry
+        for entry in os.listdir(cache_dir)
+        if entry != key and published.fullmatch(entry)
+    ]
+
+
+def read_frame_cache(version, cache_dir=CACHE_DIR, path=FILE_PATH):
+    if feather is None:
+        return None
+    base = os.path.join(cache_dir, cache_key(version, path))
+    if not os.path.isdir(base):
+        return None
+    try:
+        frames = [
+            feather.read_table(
+                os.path.join(base, f"{name}.feather"), memory_map=True
+            ).to_pandas()
+            for name in CACHE_FRAMES
+        ]
+    except Exception as e:
+        print("CACHE READ ERROR:", e)
+        return None
+
+    # relative to today, so never taken from the cache
+    df_full = frames[0]
+    df_full["DaysToDepletion"] = days_to_depletion(df_full["DepletionDate_parsed"])
+    return tuple(frames)
 
-# Normalise names for joins and filters
-df_full["Branch"] = df_full["Branch"].apply(normalize_branch)
-df_full["BusinessUnit"] = df_full["BusinessUnit"].str.upper()
-df_full["Brand"] = df_full["Brand"].str.upper()
 
-df_crit.rename(columns=lambda x: normalize_branch(x), inplace=True)
-df_crit["AI_SKU"] = df_crit["AI_SKU"].astype(str)
-df_crit["AI_MFGBRND"] = df_crit["AI_MFGBRND"].astype(str).str.upper()
+def write_frame_cache(version, frames, cache_dir=CACHE_DIR, path=FILE_PATH):
+    if feather is None:
+        return False
+    key = cache_key(version, path)
+    base = os.path.join(cache_dir, key)
+    tmp = f"{base}.tmp-{os.getpid()}"
+    try:
+        os.makedirs(tmp, exist_ok=True)
+        for name, df in zip(CACHE_FRAMES, frames):
+            if name == "summary":
+                df = df.drop(columns=["DaysToDepletion"])
+            feather.write_feather(
+                df.reset_index(drop=True),
+                os.path.join(tmp, f"{name}.feather"),
+                compression="uncompressed",
+            )
+        os.rename(tmp, base)
+    except Exception as e:
+        shutil.rmtree(tmp, ignore_errors=True)
+        if not (isinstance(e, OSError) and os.path.isdir(base)):
+            print("CACHE WRITE ERROR:", e)
+            return False
+        # otherwise another worker published the same key first
+
+    # drop caches of older versions of this workbook
+    try:
+        for entry in stale_cache_entries(key, path, cache_dir):
+            shutil.rmtree(os.path.join(cache_dir, entry), ignore_errors=True)
+    except OSError as e:
+        print("CACHE PRUNE ERROR:", e)
+    return True
+
+
+def compile_cache(path=FILE_PATH, cache_dir=CACHE_DIR):
+    if feather is None:
+        raise RuntimeError("pyarrow is required to compile the snapshot cache")
+    version = file_hash(path)
+    frames = load_frames(path)
+    write_frame_cache(version, frames, cache_dir, path)
+    return os.path.join(cache_dir, cache_key(version, path))
+
+
+def build_snapshot(path=FILE_PATH, signature=None, version=None):
+    signature = signature or file_signature(path)
+    version = version or file_hash(path)
+
+    frames = read_frame_cache(version, path=path)
+    if frames is None:
+        frames = load_frames(path)
+        write_frame_cache(version, frames, path=path)
+    return snapshot_from_frames(frames, version, signature)
+
+
+def snapshot_from_frames(frames, version, signature=None):
+    df_full, df_crit, df_coord = frames
+    crit = build_crit_matrix(df_crit, df_full)
+    df_crit = crit_frame(df_crit, crit)
+    index = build_filter_index(df_full)
+    return DataSnapshot(
+        version=version,
+        signature=signature,
+        loaded_at=datetime.now(),
+        df_full=df_full,
+        df_crit=df_crit,
+        df_coord=df_coord,
+        index=index,
+        search={
+            dim: build_search_index(df_full[FILTER_DIMENSIONS[dim]].cat.categories)
+            for dim in SEARCH_DROPDOWNS
+        },
+        text=build_text_index(index),
+        table=build_table_index(df_full, df_crit),
+        crit=crit,
+        inter=build_inter_rotation(df_full["InterRotation"]),
+        oos=build_oos_cube(df_full),
+        kpi=build_kpi_base(df_full),
+    )
 
-BRANDS = sorted(df_full["Brand"].unique())
-PLANTS = sorted(df_full["Plant"].unique())
-BRANCHES = sorted(df_full["Branch"].unique())
-CLASSES = sorted(df_full["Class"].unique())
-BUS_UNITS = sorted(df_full["BusinessUnit"].unique())
-AI_SKUS = sorted(df_full["SKU"].unique())
+
+def get_snapshot(path=FILE_PATH):
+    global _snapshot, _previous_snapshot
+    snap = _snapshot
+    try:
+        signature = file_signature(path)
+    except OSError:
+        # workbook is being replaced; keep serving what we have
+        if snap is None:
+            raise
+        return snap
+    if snap is not None and snap.signature == signature:
+        return snap
+
+    with _snapshot_lock:
+        snap = _snapshot
+        if snap is not None and snap.signature == signature:
+            return snap
+
+        version = file_hash(path)
+        if snap is not None and snap.version == version:
+            # touched but not changed
+            _snapshot = snap._replace(signature=signature)
+            return _snapshot
+
+        try:
+            new_snap = build_snapshot(path, signature, version)
+        except Exception as e:
+            # half-written workbook etc. -> retry on the next tick
+            if snap is None:
+                raise
+            print("DATA RELOAD ERROR:", e)
+            return snap
+
+        if snap is not None:
+            _previous_snapshot = kpi_snapshot(snap)
+        _snapshot = new_snap
+
+    # outside the lock so requests waiting on the reload skip the write
+    record_kpi_history(new_snap)
+    return new_snap
+
+
+# Facet dropdowns show "VALUE (rows)".  Long Branch/SKU lists keep only the
+# values with the most rows (plus whatever is selected) so callbacks stay
+# small; the rest are reached through the server-side search.  Dropdowns
+# without search always list every value.
+MAX_DROPDOWN_OPTIONS = 300
+
+
+def facet_limit(dim):
+    return MAX_DROPDOWN_OPTIONS if dim in SEARCH_DROPDOWNS else None
+
+
+def option_list(values, counts, codes):
+    return [{"label": f"{values[c]} ({counts[c]:,})", "value": values[c]} for c in codes]
+
+
+def facet_options(values, counts, selected=None, limit=MAX_DROPDOWN_OPTIONS):
+    keep = np.flatnonzero(counts)
+    if limit is not None and len(keep) > limit:
+        top = keep[np.argsort(-counts[keep], kind="stable")[:limit]]
+        if selected:
+            picked = values.get_indexer(list(selected))
+            picked = picked[picked >= 0]
+            top = np.union1d(top, picked[counts[picked] > 0])
+        keep = np.sort(top)
+    return option_list(values, counts, keep)
+
+
+def search_options(snap, dim, counts, text, selected=None):
+    codes = search_codes(snap.search[dim], text, allowed=counts > 0)
+    if selected:
+        # keep the current selection visible while the user types
+        picked = snap.index[dim].values.get_indexer(list(selected))
+        picked = picked[(picked >= 0) & ~np.isin(picked, codes)]
+        codes = np.concatenate([codes, picked[counts[picked] > 0]])
+    return option_list(snap.index[dim].values, counts, codes)
+
+
+_initial = get_snapshot()
+INITIAL_OPTIONS = {
+    dim: facet_options(_initial.index[dim].values, counts, limit=facet_limit(dim))
+    for dim, counts in facet_counts(_initial, {}).items()
+}
+
+BRANDS = _initial.index["brand"].values.tolist()
+PLANTS = _initial.index["plant"].values.tolist()
+BRANCHES = _initial.index["branch"].values.tolist()
+CLASSES = _initial.index["class"].values.tolist()
+BUS_UNITS = _initial.index["bu"].values.tolist()
+AI_SKUS = _initial.index["sku"].values.tolist()
 BRANCH_DC_FILTER = ["0", "1-4", "5-6", "7-10"]
 OVERSELL_FILTER = ["Yes", "No"]
 RISK_FILTER = ["Yes", "No"]  # Yes/No based on IsRisk
@@ -226,7 +1637,10 @@ def counting_dropdown(id_, count_id, options, label_text):
             ),
             dcc.Dropdown(
                 id=id_,
-                options=[{"label": o, "value": o} for o in options],
+                options=[
+                    o if isinstance(o, dict) else {"label": o, "value": o}
+                    for o in options
+                ],
                 multi=True,
                 placeholder=f"Select {label_text}",
                 className="fixed-multi-dropdown hide-chips",
@@ -236,7 +1650,7 @@ def counting_dropdown(id_, count_id, options, label_text):
     )
 
 
-def kpi_card(title, value, color="primary", trend=None):
+def kpi_card(title, value, color="primary", trend=None, spark=None):
     icon = ""
     if trend == "up":
         icon = "▲ "
@@ -266,6 +1680,17 @@ def kpi_card(title, value, color="primary", trend=None):
                         },
                     ),
                 ]
+                + (
+                    [
+                        html.Div(
+                            spark,
+                            className="text-muted kpi-spark",
+                            style={"fontSize": "0.8rem", "whiteSpace": "nowrap"},
+                        )
+                    ]
+                    if spark
+                    else []
+                )
             ),
             className=f"kpi-card border-{color}",
         ),
@@ -283,6 +1708,290 @@ def _count_label(values, base):
         return f"{base} ({len(values)} selected)"
     return f"{base} (0 selected)"
 
+# ---- Figure templates
+# The three overview figures are built once here, themed and styled, and put
+# in the layout.  Callbacks then send a Patch with only the data arrays (and
+# the bar chart title), not the whole figure.  The treemap hierarchies are
+# built directly (same ids/parents/aggregation as px.treemap with a path).
+def apply_theme(fig):
+    fig.update_layout(
+        template="plotly",
+        paper_bgcolor="#ffffff",
+        plot_bgcolor="#ffffff",
+        font_color="#263238",
+        font=dict(family='-apple-system, BlinkMacSystemFont, "SF Pro Text", "Segoe UI", system-ui, sans-serif'),
+    )
+    return fig
+
+
+OOS_COLOR_SCALE = [
+    [0.0, "#E8F5E9"],   # light green
+    [0.00001, "#C8E6C9"],
+    [0.25, "#FFF9C4"],  # soft yellow
+    [0.5, "#FFE082"],   # amber
+    [0.75, "#FFAB91"],  # orange
+    [1.0, "#E53935"],   # red
+]
+# the default plotly colorway; each branch keeps its colour across filters
+BRANCH_COLORS = px.colors.qualitative.Plotly
+OTHER_COLOR = "#B0BEC5"
+MIXED = "(?)"
+
+
+def treemap_aggregate(df, keys, value, weighted=(), distinct=(), summed=()):
+    # one treemap level aggregated as px does: sums, value-weighted means, and
+    # distinct columns that are "(?)" where a node mixes values
+    frame = df[keys + [value] + list(summed)].copy()
+    for col in weighted:
+        frame[col] = df[col]
+        frame[col + "_w"] = df[col] * df[value]
+    # a path column is distinct on every node below its own level
+    distinct_here = [col for col in distinct if col not in keys]
+    for col in distinct_here:
+        frame[col] = df[col]
+    g = frame.groupby(keys, sort=True)
+    node = g[[value] + list(summed)].sum()
+    for col in weighted:
+        total = g[col + "_w"].sum()
+        node[col] = (total / node[value]).where(node[value] != 0, g[col].mean())
+    for col in distinct_here:
+        node[col] = g[col].first().where(g[col].nunique(dropna=False) == 1, MIXED)
+    return node.reset_index()
+
+
+def path_ids(node, keys):
+    # each row's path as a JSON list: ["Brand","Plant"]
+    if not keys:
+        return pd.Series("", index=node.index, dtype=object)
+    ids = None
+    for key in keys:
+        part = node[key].map({v: json.dumps(v) for v in node[key].unique()})
+        part = part.astype(object)
+        ids = part if ids is None else ids + "," + part
+    return "[" + ids + "]"
+
+
+def label_nodes(node, keys, path):
+    node["labels"] = node[keys[-1]]
+    node["id"] = path_ids(node, keys)
+    node["parent"] = path_ids(node, keys[:-1])
+    node["top"] = node[path[0]]
+    node["depth"] = len(keys)
+    return node
+
+
+def treemap_nodes(df, path, value, **agg):
+    # every node of a path treemap, leaves first
+    levels = [
+        label_nodes(treemap_aggregate(df, path[:depth], value, **agg), path[:depth], path)
+        for depth in range(len(path), 0, -1)
+    ]
+    return pd.concat(levels, ignore_index=True)
+
+
+# Level of detail: each parent shows its TREEMAP_TOP_N largest children and
+# rolls the rest into an "Other (n)" node, so a figure has at most about
+# TOP_N ** depth nodes whatever the SKU count.  Clicking a node re-roots the
+# treemap on it, clicking "Other" pages on to the next TOP_N children, and
+# clicking the root goes back up.  TREEMAP_TOP_N=0 draws everything.
+TREEMAP_TOP_N = int(os.environ.get("TREEMAP_TOP_N", "10"))
+TREEMAP_ROOT = {"path": [], "skip": 0}
+
+
+def other_nodes(tail, value, weighted=(), distinct=(), summed=()):
+    g = tail.groupby("parent", sort=False)
+    other = g[[value] + list(summed)].sum()
+    for col in weighted:
+        total = (tail[col] * tail[value]).groupby(tail["parent"], sort=False).sum()
+        other[col] = (total / other[value]).where(other[value] != 0, g[col].mean())
+    for col in distinct:
+        other[col] = g[col].first().where(g[col].nunique(dropna=False) == 1, MIXED)
+    other["labels"] = [f"Other ({n:,})" for n in g.size()]
+    other["depth"] = g["depth"].first()
+    other["top"] = g["top"].first().where(other["depth"] > 1, MIXED)
+    other = other.reset_index()
+    # same path as the parent plus a null: ["Brand", "Plant", null]
+    other["id"] = [p[:-1] + ",null]" if p else "[null]" for p in other["parent"]]
+    return other
+
+
+def treemap_lod(df, path, value, focus=None, rank=None, top_n=None, **agg):
+    # built top down: each level only aggregates rows under the kept children
+    top_n = TREEMAP_TOP_N if top_n is None else top_n
+    focus = focus or TREEMAP_ROOT
+    keys = list(focus.get("path") or [])[: len(path) - 1]
+    skip = int(focus.get("skip") or 0)
+    rank = rank or [value]
+    if top_n <= 0:
+        return treemap_nodes(df, path, value, **agg)
+
+    rows = df
+    for col, key in zip(path, keys):
+        rows = rows[rows[col] == key]
+
+    base = len(keys)
+    shown = []
+    if base:
+        root_keys = path[:base]
+        root = label_nodes(
+            treemap_aggregate(rows, root_keys, value, **agg), root_keys, path
+        )
+        root["parent"] = ""
+        shown.append(root)
+    for depth in range(base + 1, len(path) + 1):
+        level_keys = path[:depth]
+        parent_keys = level_keys[:-1]
+        node = treemap_aggregate(rows, level_keys, value, **agg)
+        node = node.sort_values(
+            parent_keys + rank,
+            ascending=[True] * len(parent_keys) + [False] * len(rank),
+            kind="stable",
+        )
+        if parent_keys:
+            pos = node.groupby(parent_keys, sort=False).cumcount().to_numpy()
+        else:
+            pos = np.arange(len(node))
+        lo = skip if depth == base + 1 else 0
+        keep = label_nodes(node[(pos >= lo) & (pos < lo + top_n)].copy(), level_keys, path)
+        shown.append(keep)
+        tail = node[pos >= lo + top_n].copy()
+        if len(tail):
+            tail["parent"] = path_ids(tail, parent_keys)
+            tail["top"] = tail[path[0]]
+            tail["depth"] = depth
+            shown.append(other_nodes(tail, value, **agg))
+        # the next level only looks at rows under the kept children
+        kept = pd.MultiIndex.from_frame(keep[level_keys])
+        rows = rows[pd.MultiIndex.from_frame(rows[level_keys]).isin(kept)]
+    out = pd.concat(shown, ignore_index=True) if shown else rows.iloc[:0]
+    if skip and len(out):
+        # paging past the first children: the root holds only what is shown,
+        # and at the top an "All" root is added to click back to page one
+        first = out["depth"] == base + 1
+        if not base:
+            root = other_nodes(out[first], value, **agg)
+            root[["id", "labels", "depth"]] = ["[]", "All", 0]
+            out.loc[first, "parent"] = "[]"
+            out = pd.concat([root, out], ignore_index=True)
+            first = out["depth"] == 1
+        out.loc[0, value] = out.loc[first, value].sum()
+        out.loc[0, "labels"] = f"{out.loc[0, 'labels']} (more)"
+    return out
+
+
+def treemap_level(nodes, focus):
+    # treemap_lod puts the focused node (or the paged "All" root) first
+    focus = focus or TREEMAP_ROOT
+    if TREEMAP_TOP_N > 0 and (focus.get("path") or focus.get("skip")) and len(nodes):
+        return nodes["id"].iloc[0]
+    return ""
+
+
+def treemap_focus(click, focus, depth):
+    # new focus after a click on a treemap node, or None for no change
+    focus = focus or TREEMAP_ROOT
+    try:
+        node = json.loads(click["points"][0]["id"])
+    except (KeyError, IndexError, TypeError, ValueError):
+        return None
+    current, skip = list(focus.get("path") or []), int(focus.get("skip") or 0)
+    if node and node[-1] is None:
+        parent = node[:-1]
+        skip = skip + TREEMAP_TOP_N if parent == current else TREEMAP_TOP_N
+        return {"path": parent, "skip": skip}
+    if node == current:
+        # the root: back to the first page, or up one level
+        return {"path": node if skip else node[:-1], "skip": 0}
+    if len(node) < depth:
+        return {"path": node, "skip": 0}
+    return None
+
+
+def plant_treemap_template():
+    fig = go.Figure(
+        go.Treemap(
+            branchvalues="total",
+            marker=dict(coloraxis="coloraxis"),
+            texttemplate="<b>%{label}</b><br>%{value:,.0f} cs",
+            hovertemplate=(
+                "<b>%{label}</b><br>"
+                "Balance Supply: %{value:,.0f} cs<br>"
+                "OOS Gap: %{color:,.0f} cs<br>"
+                "Plant Inventory: %{customdata[0]:,.0f} cs"
+                "<extra></extra>"
+            ),
+        )
+    )
+    fig.update_layout(
+        title="Plant Inventory Overview",
+        margin=dict(t=40, l=10, r=10, b=10),
+        coloraxis=dict(
+            colorscale=OOS_COLOR_SCALE, colorbar={"title": "OOS Gap (cs)"}
+        ),
+    )
+    return apply_theme(fig)
+
+
+def oos_bar_template():
+    fig = go.Figure()
+    fig.add_bar(
+        name="OOS Gap (cs)",
+        marker_color="#E53935",
+        textposition="outside",
+        hovertemplate=(
+            "<b>%{x}</b><br>"
+            "OOS Gap: %{y:,.0f} cs"
+            "<extra></extra>"
+        ),
+    )
+    fig.add_bar(
+        name="Risk Exposure (cs)",
+        marker_color="#FB8C00",
+        textposition="outside",
+        hovertemplate=(
+            "<b>%{x}</b><br>"
+            "Risk Exposure: %{y:,.0f} cs"
+            "<extra></extra>"
+        ),
+    )
+    fig.update_layout(
+        barmode="group",
+        title="OOS & Risk Exposure",
+        margin=dict(t=60, b=130, l=10, r=10),
+        xaxis_tickangle=-30,
+        legend=dict(
+            orientation="h",
+            yanchor="bottom",
+            y=1.02,
+            xanchor="right",
+            x=1,
+        ),
+    )
+    return apply_theme(fig)
+
+
+def branch_treemap_template():
+    fig = go.Figure(
+        go.Treemap(
+            branchvalues="total",
+            marker=dict(colors=[]),
+            hovertemplate=(
+                "<b>%{label}</b><br>"
+                "SKU: %{customdata[0]}<br>"
+                "Balance Supply: %{value:,} cs"
+                "<extra></extra>"
+            ),
+        )
+    )
+    fig.update_layout(margin=dict(t=40, l=10, r=10, b=10))
+    return apply_theme(fig)
+
+
+PLANT_TREEMAP_FIGURE = plant_treemap_template()
+OOS_BAR_FIGURE = oos_bar_template()
+BRANCH_TREEMAP_FIGURE = branch_treemap_template()
+
+
 app = dash.Dash(
     __name__,
     external_stylesheets=[dbc.themes.BOOTSTRAP],
@@ -482,8 +2191,13 @@ app.layout = dbc.Container(
             className="mb-2",
         ),
 
-        # Auto-refresh interval (2 minutes)
+        # Auto-refresh interval (2 minutes); data-version holds the snapshot
+        # the client last rendered so unchanged ticks skip the heavy callbacks
         dcc.Interval(id="refresh-interval", interval=120000, n_intervals=0),
+        dcc.Store(id="data-version", data=_initial.version),
+        # treemap drill-down focus, back to the top whenever the filters change
+        dcc.Store(id="plant-inv-focus", data=TREEMAP_ROOT),
+        dcc.Store(id="branch-treemap-focus", data=TREEMAP_ROOT),
 
         # Filters row
         dbc.Row(
@@ -524,7 +2238,7 @@ app.layout = dbc.Container(
                                     counting_dropdown(
                                         "brand-filter",
                                         "brand-count-label",
-                                        BRANDS,
+                                        INITIAL_OPTIONS["brand"],
                                         "Brand",
                                     ),
                                     md=3,
@@ -533,7 +2247,7 @@ app.layout = dbc.Container(
                                     counting_dropdown(
                                         "plant-filter",
                                         "plant-count-label",
-                                        PLANTS,
+                                        INITIAL_OPTIONS["plant"],
                                         "Plant",
                                     ),
                                     md=2,
@@ -542,7 +2256,7 @@ app.layout = dbc.Container(
                                     counting_dropdown(
                                         "branch-filter",
                                         "branch-count-label",
-                                        BRANCHES,
+                                        INITIAL_OPTIONS["branch"],
                                         "Branch",
                                     ),
                                     md=3,
@@ -551,7 +2265,7 @@ app.layout = dbc.Container(
                                     counting_dropdown(
                                         "class-filter",
                                         "class-count-label",
-                                        CLASSES,
+                                        INITIAL_OPTIONS["class"],
                                         "Class",
                                     ),
                                     md=2,
@@ -560,7 +2274,7 @@ app.layout = dbc.Container(
                                     counting_dropdown(
                                         "busunit-filter",
                                         "bu-count-label",
-                                        BUS_UNITS,
+                                        INITIAL_OPTIONS["bu"],
                                         "BU",
                                     ),
                                     md=2,
@@ -574,7 +2288,7 @@ app.layout = dbc.Container(
                                     counting_dropdown(
                                         "ai-sku-filter",
                                         "sku-count-label",
-                                        AI_SKUS,
+                                        INITIAL_OPTIONS["sku"],
                                         "SKU",
                                     ),
                                     md=4,
@@ -639,6 +2353,7 @@ app.layout = dbc.Container(
                                         dbc.Col(
                                             dcc.Graph(
                                                 id="plant-inv-chart",
+                                                figure=PLANT_TREEMAP_FIGURE,
                                                 style={"height": "640px"},
                                             ),
                                             md=6,
@@ -646,6 +2361,7 @@ app.layout = dbc.Container(
                                         dbc.Col(
                                             dcc.Graph(
                                                 id="oos-risk-bar",
+                                                figure=OOS_BAR_FIGURE,
                                                 style={"height": "640px"},
                                             ),
                                             md=6,
@@ -660,6 +2376,7 @@ app.layout = dbc.Container(
                             children=[
                                 dcc.Graph(
                                     id="branch-oos-treemap",
+                                    figure=BRANCH_TREEMAP_FIGURE,
                                     style={"height": "620px"},
                                 )
                             ],
@@ -689,12 +2406,15 @@ app.layout = dbc.Container(
                                     id="info-table",
                                     columns=[],
                                     data=[],
-                                    page_size=15,
-                                    export_format="xlsx",
+                                    page_current=0,
+                                    page_size=INFO_PAGE_SIZE,
+                                    page_action="custom",
                                     merge_duplicate_headers=True,
                                     style_as_list_view=True,
-                                    sort_action="native",
-                                    filter_action="native",
+                                    sort_action="custom",
+                                    sort_by=[],
+                                    filter_action="custom",
+                                    filter_query="",
                                     row_selectable="multi",
                                     style_table={
                                         "overflowX": "auto",
@@ -761,6 +2481,19 @@ app.layout = dbc.Container(
                                             width="auto",
                                         ),
                                         dbc.Col(width=True),
+                                        dbc.Col(
+                                            dbc.Pagination(
+                                                id="crit-col-page",
+                                                min_value=1,
+                                                max_value=1,
+                                                active_page=1,
+                                                fully_expanded=False,
+                                                previous_next=True,
+                                                size="sm",
+                                                className="mb-2",
+                                            ),
+                                            width="auto",
+                                        ),
                                         dcc.Download(id="crit-download"),
                                     ],
                                     className="mb-1",
@@ -769,11 +2502,14 @@ app.layout = dbc.Container(
                                     id="crit-table",
                                     columns=[],
                                     data=[],
-                                    page_size=15,
-                                    export_format="xlsx",
+                                    page_current=0,
+                                    page_size=CRIT_PAGE_SIZE,
+                                    page_action="custom",
                                     style_as_list_view=True,
-                                    sort_action="native",
-                                    filter_action="native",
+                                    sort_action="custom",
+                                    sort_by=[],
+                                    filter_action="custom",
+                                    filter_query="",
                                     style_table={
                                         "overflowX": "auto",
                                         "minWidth": "100%",
@@ -818,8 +2554,8 @@ app.layout = dbc.Container(
     fluid=True,
 )
 
-def apply_filters(
-    base_df,
+def filter_masks(
+    snap,
     brands,
     plants,
     branches,
@@ -830,71 +2566,379 @@ def apply_filters(
     oversell,
     risk,
     global_search,
-    ignore=None,
 ):
-    ignore = ignore or set()
-    df = base_df.copy()
-
-    if "brand" not in ignore and brands:
-        df = df[df["Brand"].isin(brands)]
-    if "plant" not in ignore and plants:
-        df = df[df["Plant"].isin(plants)]
-    if "branch" not in ignore and branches:
-        df = df[df["Branch"].isin(branches)]
-    if "class" not in ignore and classes:
-        df = df[df["Class"].isin(classes)]
-    if "bu" not in ignore and busunits:
-        df = df[df["BusinessUnit"].isin(busunits)]
-    if "sku" not in ignore and ai_skus:
-        df = df[df["SKU"].isin(ai_skus)]
-    if "oversell" not in ignore and oversell:
-        flags = [1 if v == "Yes" else 0 for v in oversell]
-        df = df[df["IsOversell"].isin(flags)]
-    if "risk" not in ignore and risk:
-        mask = pd.Series(False, index=df.index)
-        if "Yes" in risk:
-            mask |= df["IsRisk"] == 1
-        if "No" in risk:
-            mask |= df["IsRisk"] == 0
-        df = df[mask]
-
-    # branch DC band filtering
-    if "dc" not in ignore and branch_dc:
-        mask = pd.Series(False, index=df.index)
-        for b in branch_dc:
-            if b == "0":
-                mask |= df["DaysToDepletion"] <= 0
-            elif b == "1-4":
-                mask |= df["DaysToDepletion"].between(1, 4)
-            elif b == "5-6":
-                mask |= df["DaysToDepletion"].between(5, 6)
-            elif b == "7-10":
-                mask |= df["DaysToDepletion"].between(7, 10)
-        df = df[mask]
-
-    # global search
-    if "global" not in ignore and global_search and global_search.strip():
-        gs = global_search.strip().lower()
-        search_cols = ["SKU", "Brand", "BusinessUnit", "Branch", "Plant", "Class"]
-        mask = pd.Series(False, index=df.index)
-        for col in search_cols:
-            mask |= df[col].astype(str).str.lower().str.contains(gs)
-        df = df[mask]
+    # one row mask per active filter, keyed like apply_filters' ``ignore``
+    index = snap.index
+    selected = {
+        "brand": brands,
+        "plant": plants,
+        "branch": branches,
+        "class": classes,
+        "bu": busunits,
+        "sku": ai_skus,
+        "oversell": ["Yes" if v == "Yes" else "No" for v in oversell or []],
+        "risk": risk,
+        "dc": branch_dc,
+    }
+    masks = {
+        dim: value_mask(index[dim], values)
+        for dim, values in selected.items()
+        if values
+    }
 
-    return df
+    # global search: match on the distinct values, then map to rows
+    if global_search and global_search.strip():
+        mask = np.zeros(len(snap.df_full), dtype=bool)
+        for dim, codes in text_search(snap.text, global_search).items():
+            if len(codes):
+                mask |= postings_mask(index[dim], codes)
+        masks["global"] = mask
 
-@app.callback(
-    Output("filter-collapse", "is_open"),
-    Input("filter-toggle", "n_clicks"),
-    State("filter-collapse", "is_open"),
-)
-def toggle_filters(n, is_open):
-    if n:
-        return not is_open
-    return is_open
+    return masks
 
-@app.callback(
-    Output("brand-filter", "options"),
+
+def combine_masks(masks, n, ignore=None):
+    ignore = ignore or set()
+    mask = None
+    for dim, m in masks.items():
+        if dim in ignore:
+            continue
+        mask = m.copy() if mask is None else mask & m
+    if mask is None:
+        return np.arange(n)
+    return np.flatnonzero(mask)
+
+
+def filter_rows(snap, *filters, ignore=None):
+    return combine_masks(filter_masks(snap, *filters), len(snap.df_full), ignore)
+
+
+# ---- Filter-state result cache
+# Every filter callback starts from the same filter state, and most sessions
+# open on the unfiltered default view.  Results derived from a state (row
+# numbers, facet counts, the filtered view) are memoised per data version in
+# small LRUs with a TTL; a new snapshot version simply stops matching.
+RESULT_CACHE_LIMITS = {
+    "rows": int(os.environ.get("RESULT_CACHE_ROWS", "64")),
+    "facets": int(os.environ.get("RESULT_CACHE_FACETS", "64")),
+    # whole filtered frames, keep only a few
+    "view": int(os.environ.get("RESULT_CACHE_VIEWS", "8")),
+    # sorted/filtered Information table rows, one per table state
+    "table": int(os.environ.get("RESULT_CACHE_TABLES", "16")),
+    # KPI values, for the current and the previous snapshot
+    "kpis": int(os.environ.get("RESULT_CACHE_KPIS", "64")),
+}
+RESULT_CACHE_TTL = float(os.environ.get("RESULT_CACHE_TTL", "900"))
+
+_results = {kind: OrderedDict() for kind in RESULT_CACHE_LIMITS}
+_results_lock = threading.Lock()
+_result_stats = {
+    kind: {"hits": 0, "misses": 0, "evictions": 0, "expired": 0}
+    for kind in RESULT_CACHE_LIMITS
+}
+
+
+def filter_key(filters):
+    # order and duplicates in a multi-select never change the selected rows
+    *values, global_search = filters
+    key = [tuple(sorted(set(v), key=str)) if v else None for v in values]
+    key.append((global_search or "").strip().lower() or None)
+    return tuple(key)
+
+
+def cached_result(kind, snap, filters, compute, extra=()):
+    cache, stats = _results[kind], _result_stats[kind]
+    key = (snap.version, filter_key(filters), extra)
+    now = time.monotonic()
+    with _results_lock:
+        entry = cache.get(key)
+        if entry is not None:
+            stored_at, value = entry
+            if now - stored_at <= RESULT_CACHE_TTL:
+                cache.move_to_end(key)
+                stats["hits"] += 1
+                return value
+            del cache[key]
+            stats["expired"] += 1
+        stats["misses"] += 1
+
+    value = compute()
+    with _results_lock:
+        cache[key] = (now, value)
+        cache.move_to_end(key)
+        while len(cache) > RESULT_CACHE_LIMITS[kind]:
+            cache.popitem(last=False)
+            stats["evictions"] += 1
+    return value
+
+
+def clear_results():
+    with _results_lock:
+        for cache in _results.values():
+            cache.clear()
+
+
+def result_cache_stats():
+    with _results_lock:
+        report = {
+            kind: dict(
+                _result_stats[kind],
+                entries=len(_results[kind]),
+                limit=RESULT_CACHE_LIMITS[kind],
+            )
+            for kind in RESULT_CACHE_LIMITS
+        }
+    for stats in report.values():
+        lookups = stats["hits"] + stats["misses"]
+        stats["hit_rate"] = round(stats["hits"] / lookups, 3) if lookups else None
+    return {"ttl": RESULT_CACHE_TTL, "caches": report, "shared": shared_cache_stats()}
+
+
+@server.route("/cache-stats")
+def cache_stats():
+    return jsonify(result_cache_stats())
+
+
+# ---- Shared result cache (optional)
+# Under gunicorn every worker has its own snapshot and result caches, so a
+# follow-up request often lands on a cold worker.  With SHARED_CACHE_PATH set,
+# rendered callback outputs (figures, KPI cards, table data) are also kept in
+# a SQLite file that all workers on the host share, trimmed back to
+# SHARED_CACHE_MAX_MB by least recent use.  Rows are tagged with the snapshot
+# version they were rendered from; the first write after a worker moves to a
+# new version purges every other version's rows.
+SHARED_CACHE_PATH = os.environ.get("SHARED_CACHE_PATH")
+SHARED_CACHE_MAX_BYTES = int(float(os.environ.get("SHARED_CACHE_MAX_MB", "256")) * 2**20)
+
+_shared_local = threading.local()
+_shared_version = None  # last version this process purged the cache for
+
+
+def shared_cache_db():
+    # one connection per thread, and never one inherited across a fork
+    conn = getattr(_shared_local, "conn", None)
+    if conn is None or _shared_local.pid != os.getpid():
+        conn = sqlite3.connect(SHARED_CACHE_PATH, timeout=5, isolation_level=None)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS results ("
+            "key TEXT PRIMARY KEY, version TEXT, value BLOB, size INTEGER, used REAL)"
+        )
+        conn.execute("CREATE INDEX IF NOT EXISTS results_used ON results (used)")
+        _shared_local.conn, _shared_local.pid = conn, os.getpid()
+    return conn
+
+
+def shared_get(key):
+    try:
+        db = shared_cache_db()
+        row = db.execute("SELECT value FROM results WHERE key = ?", (key,)).fetchone()
+        if row is None:
+            return None
+        db.execute("UPDATE results SET used = ? WHERE key = ?", (time.time(), key))
+        return pickle.loads(row[0])
+    except Exception as e:
+        print("SHARED CACHE ERROR:", e)
+        return None
+
+
+def shared_put(key, version, value):
+    global _shared_version
+    try:
+        blob = pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL)
+        if len(blob) > SHARED_CACHE_MAX_BYTES:
+            return
+        db = shared_cache_db()
+        db.execute("BEGIN IMMEDIATE")
+        try:
+            if version != _shared_version:
+                # outputs of older workbooks can never be served again
+                db.execute("DELETE FROM results WHERE version != ?", (version,))
+            db.execute(
+                "INSERT OR REPLACE INTO results VALUES (?, ?, ?, ?, ?)",
+                (key, version, blob, len(blob), time.time()),
+            )
+            (total,) = db.execute("SELECT COALESCE(SUM(size), 0) FROM results").fetchone()
+            if total > SHARED_CACHE_MAX_BYTES:
+                # least recently used first, until back under the limit
+                doomed = []
+                for old_key, size in db.execute(
+                    "SELECT key, size FROM results ORDER BY used"
+                ):
+                    if total <= SHARED_CACHE_MAX_BYTES:
+                        break
+                    doomed.append((old_key,))
+                    total -= size
+                db.executemany("DELETE FROM results WHERE key = ?", doomed)
+            db.execute("COMMIT")
+            _shared_version = version
+        except Exception:
+            db.execute("ROLLBACK")
+            raise
+    except Exception as e:
+        print("SHARED CACHE ERROR:", e)
+
+
+def shared_cache_stats():
+    if not SHARED_CACHE_PATH:
+        return None
+    try:
+        entries, size = shared_cache_db().execute(
+            "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM results"
+        ).fetchone()
+    except Exception as e:
+        print("SHARED CACHE ERROR:", e)
+        return None
+    return {"entries": entries, "bytes": size, "limit_bytes": SHARED_CACHE_MAX_BYTES}
+
+
+def shared_output(name, previous=False):
+    # for callbacks shaped (..., data_version, *filters) that call
+    # get_snapshot(); the key uses the snapshot actually served (and, for
+    # outputs compared against it, the snapshot it replaced)
+    def decorate(fn):
+        if not SHARED_CACHE_PATH:
+            return fn
+
+        @wraps(fn)
+        def wrapper(*args):
+            args = list(args)
+            # (*options, data_version, *filters)
+            n = len(FILTER_INPUTS)
+            filters, options = args[-n:], args[: -n - 1]
+            version = get_snapshot().version
+            versions = (version, previous_version()) if previous else version
+            key = hashlib.sha1(
+                repr((name, versions, options, filter_key(filters))).encode()
+            ).hexdigest()
+            result = shared_get(key)
+            if result is None:
+                result = fn(*args)
+                shared_put(key, version, result)
+            return result
+
+        return wrapper
+
+    return decorate
+
+
+def cached_rows(snap, filters):
+    def compute():
+        rows = filter_rows(snap, *filters)
+        # shared between callbacks
+        rows.flags.writeable = False
+        return rows
+
+    return cached_result("rows", snap, filters, compute)
+
+
+def kpi_values(snap, filters):
+    return cached_result(
+        "kpis", snap, filters, lambda: compute_kpis(snap, cached_rows(snap, filters))
+    )
+
+
+def kpi_history(snap, filters):
+    if not KPI_HISTORY_PATH:
+        return None
+    since = snap.loaded_at.date() - timedelta(days=KPI_HISTORY_DAYS - 1)
+    return cached_result(
+        "kpis",
+        snap,
+        filters,
+        lambda: read_kpi_history(filters, since.isoformat()),
+        extra=("history",),
+    )
+
+
+def history_before(history, day):
+    # values of the last stored day before `day`
+    if not history:
+        return {}
+    earlier = [i for i, d in enumerate(history.days) if d < day]
+    if not earlier:
+        return {}
+    return {field: values[earlier[-1]] for field, values in history.values.items()}
+
+
+def info_table_rows(snap, filters, sort_by, filter_query):
+    # rows of the Information table in display order, after its own filters
+    def compute():
+        table = snap.table["info"]
+        rows = table_filter(table, cached_rows(snap, filters), filter_query)
+        rows = table_sort(table, rows, sort_by)
+        rows.flags.writeable = False
+        return rows
+
+    sort_key = tuple((s["column_id"], s["direction"]) for s in sort_by or [])
+    return cached_result(
+        "table", snap, filters, compute, extra=(sort_key, filter_query or "")
+    )
+
+
+def crit_table_rows(snap, filters, sort_by, filter_query):
+    # criticality rows for the filtered SKUs / brands, and the positions of
+    # the filtered branches' columns, in sheet order
+    def compute():
+        crit = snap.crit
+        rows = cached_rows(snap, filters)
+        if not len(rows) or not len(crit.skus):
+            return np.arange(0), np.arange(0)
+        index = snap.index
+        keep = (
+            present_values(index["sku"], rows)[crit.sku_codes]
+            & present_values(index["brand"], rows)[crit.brand_codes]
+        )
+        crit_rows = np.flatnonzero(keep)
+        branch_cols = np.flatnonzero(
+            present_values(index["branch"], rows)[crit.branch_codes]
+        )
+        table = snap.table["crit"]
+        crit_rows = table_filter(table, crit_rows, filter_query)
+        crit_rows = table_sort(table, crit_rows, sort_by)
+        read_only(crit_rows, branch_cols)
+        return crit_rows, branch_cols
+
+    sort_key = tuple((s["column_id"], s["direction"]) for s in sort_by or [])
+    return cached_result(
+        "table", snap, filters, compute, extra=("crit", sort_key, filter_query or "")
+    )
+
+
+def apply_filters(snap, *filters, ignore=None):
+    if ignore:
+        rows = filter_rows(snap, *filters, ignore=ignore)
+    else:
+        rows = cached_rows(snap, filters)
+    if len(rows) == len(snap.df_full):
+        return snap.df_full  # shared and read-only: callers must not mutate it
+    return snap.df_full.iloc[rows]
+
+@app.callback(
+    Output("data-version", "data"),
+    Input("refresh-interval", "n_intervals"),
+    State("data-version", "data"),
+)
+def refresh_data_version(n_intervals, current_version):
+    snap = get_snapshot()
+    if snap.version == current_version:
+        raise PreventUpdate
+    return snap.version
+
+
+@app.callback(
+    Output("filter-collapse", "is_open"),
+    Input("filter-toggle", "n_clicks"),
+    State("filter-collapse", "is_open"),
+)
+def toggle_filters(n, is_open):
+    if n:
+        return not is_open
+    return is_open
+
+@app.callback(
+    Output("brand-filter", "options"),
     Output("plant-filter", "options"),
     Output("branch-filter", "options"),
     Output("class-filter", "options"),
@@ -910,6 +2954,9 @@ def toggle_filters(n, is_open):
     Input("oversell-filter", "value"),
     Input("risk-filter", "value"),
     Input("global-search", "value"),
+    Input("data-version", "data"),
+    Input("branch-filter", "search_value"),
+    Input("ai-sku-filter", "search_value"),
 )
 def update_filter_options(
     brands,
@@ -922,10 +2969,12 @@ def update_filter_options(
     oversell,
     risk,
     global_search,
+    data_version,
+    branch_search,
+    sku_search,
 ):
-    # Brand options
-    df_brand = apply_filters(
-        df_full,
+    snap = get_snapshot()
+    filters = (
         brands,
         plants,
         branches,
@@ -936,102 +2985,49 @@ def update_filter_options(
         oversell,
         risk,
         global_search,
-        ignore={"brand"},
     )
-    brand_opts = [{"label": b, "value": b} for b in sorted(df_brand["Brand"].unique())]
-
-    # Plant options
-    df_plant = apply_filters(
-        df_full,
-        brands,
-        plants,
-        branches,
-        classes,
-        busunits,
-        ai_skus,
-        branch_dc,
-        oversell,
-        risk,
-        global_search,
-        ignore={"plant"},
+    selected = dict(
+        zip(FACET_DIMENSIONS, [brands, plants, branches, classes, busunits, ai_skus])
     )
-    plant_opts = [{"label": p, "value": p} for p in sorted(df_plant["Plant"].unique())]
+    search_text = {"branch": branch_search, "sku": sku_search}
 
-    # Branch options
-    df_branch = apply_filters(
-        df_full,
-        brands,
-        plants,
-        branches,
-        classes,
-        busunits,
-        ai_skus,
-        branch_dc,
-        oversell,
-        risk,
-        global_search,
-        ignore={"branch"},
-    )
-    branch_opts = [
-        {"label": b, "value": b} for b in sorted(df_branch["Branch"].unique())
-    ]
-
-    # Class options
-    df_class = apply_filters(
-        df_full,
-        brands,
-        plants,
-        branches,
-        classes,
-        busunits,
-        ai_skus,
-        branch_dc,
-        oversell,
-        risk,
-        global_search,
-        ignore={"class"},
-    )
-    class_opts = [
-        {"label": c, "value": c} for c in sorted(df_class["Class"].unique())
-    ]
-
-    # BU options
-    df_bu = apply_filters(
-        df_full,
-        brands,
-        plants,
-        branches,
-        classes,
-        busunits,
-        ai_skus,
-        branch_dc,
-        oversell,
-        risk,
-        global_search,
-        ignore={"bu"},
-    )
-    bu_opts = [
-        {"label": b, "value": b} for b in sorted(df_bu["BusinessUnit"].unique())
-    ]
-
-    # SKU options
-    df_sku = apply_filters(
-        df_full,
-        brands,
-        plants,
-        branches,
-        classes,
-        busunits,
-        ai_skus,
-        branch_dc,
-        oversell,
-        risk,
-        global_search,
-        ignore={"sku"},
+    # typing in a searchable dropdown only refreshes that dropdown
+    search_props = {
+        "branch-filter.search_value": "branch",
+        "ai-sku-filter.search_value": "sku",
+    }
+    triggered = set(dash.ctx.triggered_prop_ids)
+    if triggered and triggered <= set(search_props):
+        dims = [search_props[p] for p in triggered]
+    else:
+        dims = FACET_DIMENSIONS
+    facets = cached_result(
+        "facets",
+        snap,
+        filters,
+        lambda: facet_counts(snap, filter_masks(snap, *filters)),
     )
-    sku_opts = [{"label": s, "value": s} for s in sorted(df_sku["SKU"].unique())]
-
-    return brand_opts, plant_opts, branch_opts, class_opts, bu_opts, sku_opts
+    facets = {dim: facets[dim] for dim in dims}
+
+    # brand, plant, branch, class, BU, SKU options
+    options = []
+    for dim in FACET_DIMENSIONS:
+        if dim not in facets:
+            options.append(dash.no_update)
+        elif search_text.get(dim):
+            options.append(
+                search_options(snap, dim, facets[dim], search_text[dim], selected[dim])
+            )
+        else:
+            options.append(
+                facet_options(
+                    snap.index[dim].values,
+                    facets[dim],
+                    selected[dim],
+                    limit=facet_limit(dim),
+                )
+            )
+    return tuple(options)
 
 
 @app.callback(
@@ -1083,19 +3079,15 @@ def update_dropdown_classes(
     )
 
 
-@app.callback(
-    Output("kpi-row", "children"),
-    Output("plant-inv-chart", "figure"),
-    Output("oos-risk-bar", "figure"),
-    Output("branch-oos-treemap", "figure"),
-    Output("info-table", "columns"),
-    Output("info-table", "data"),
-    Output("crit-table", "columns"),
-    Output("crit-table", "data"),
-    Output("crit-table", "style_data_conditional"),
-    Output("inter-rotation-map", "figure"),
-    Output("last-refresh", "children"),
-    Input("view-mode", "value"),
+# ---- Shared filtered view
+# All dashboard callbacks start from the same filtered rows.  The prepared
+# frame and the SKU x Plant OOS gap are built once per data snapshot and
+# filter state and then shared, read-only, by whichever callbacks fire.
+FilteredView = namedtuple(
+    "FilteredView", ["dff", "rows", "gap", "oos_treemap", "total_oos_cases"]
+)
+
+FILTER_INPUTS = [
     Input("brand-filter", "value"),
     Input("plant-filter", "value"),
     Input("branch-filter", "value"),
@@ -1106,248 +3098,203 @@ def update_dropdown_classes(
     Input("oversell-filter", "value"),
     Input("risk-filter", "value"),
     Input("global-search", "value"),
-    Input("refresh-interval", "n_intervals"),
-)
-def update_dashboard(
-    view_mode,
-    brands,
-    plants,
-    branches,
-    classes,
-    busunits,
-    ai_skus,
-    branch_dc,
-    oversell,
-    risk,
-    global_search,
-    n_intervals,
-):
-    # ---- Filtered data
-    dff = apply_filters(
-        df_full,
-        brands,
-        plants,
-        branches,
-        classes,
-        busunits,
-        ai_skus,
-        branch_dc,
-        oversell,
-        risk,
-        global_search,
+]
+
+def build_filtered_view(snap, filters):
+    rows = cached_rows(snap, filters)
+    dff = apply_filters(snap, *filters)
+
+    # measures are stored as float32 (coerced at load); sum them in float64.
+    # Shallow copy: only these two columns are replaced, the rest stay shared
+    # with the snapshot (assign() would deep-copy every column)
+    dff_filtered = dff.copy(deep=False)
+    for col in ("BalanceSupply", "Total_SKU_Plant_Inventory"):
+        dff_filtered[col] = dff[col].astype(float).fillna(0)
+
+    cube = snap.oos
+    gap = oos_gap(cube, rows)
+    pairs = cube.trio_pair[gap.trios]
+    oos_treemap = pd.DataFrame(
+        {
+            "SKU": cube.pair_sku[pairs],
+            "Plant": cube.pair_plant[pairs],
+            "Brand": cube.trio_brand[gap.trios],
+            "BalanceSupply": gap.supply[pairs],
+            "TotalPlantInv": gap.plant_inv[pairs],
+            "OOS_Cases": gap.oos[pairs],
+        }
     )
-    dff_filtered = dff.copy()
+    total_oos_cases = int(gap.oos.sum())
 
-    dff_filtered["BalanceSupply"] = pd.to_numeric(
-        dff_filtered.get("BalanceSupply", 0), errors="coerce"
-    ).fillna(0)
-    dff_filtered["Total_SKU_Plant_Inventory"] = pd.to_numeric(
-        dff_filtered.get("Total_SKU_Plant_Inventory", 0), errors="coerce"
-    ).fillna(0)
+    return FilteredView(dff_filtered, rows, gap, oos_treemap, total_oos_cases)
 
-    if not dff_filtered.empty:
-        oos_group = (
-            dff_filtered.groupby(["SKU", "Plant"], as_index=False)
-            .agg(
-                BalanceSupply_total=("BalanceSupply", "sum"),
-                TotalPlantInv=("Total_SKU_Plant_Inventory", "max"),
-            )
-        )
-        oos_group["OOS_Cases"] = (
-            oos_group["BalanceSupply_total"] - oos_group["TotalPlantInv"]
-        ).clip(lower=0)
 
-        total_oos_cases = int(oos_group["OOS_Cases"].sum())
+def filtered_view(snap, filters):
+    return cached_result(
+        "view", snap, filters, lambda: build_filtered_view(snap, filters)
+    )
 
-        # bring Brand for treemap
-        sku_plant_brand = (
-            dff_filtered[["SKU", "Plant", "Brand"]].drop_duplicates().copy()
-        )
-        oos_treemap = oos_group.merge(
-            sku_plant_brand, on=["SKU", "Plant"], how="left"
+
+# The KPI bar is always visible; every other output only renders while its
+# tab is open and catches up when the tab is selected.
+@app.callback(
+    Output("kpi-row", "children"),
+    Output("last-refresh", "children"),
+    Input("view-mode", "value"),
+    Input("data-version", "data"),
+    *FILTER_INPUTS,
+)
+@shared_output("kpis", previous=True)
+def update_kpis(view_mode, data_version, *filters):
+    snap = get_snapshot()
+    kpis = kpi_values(snap, filters)
+    prev = _previous_snapshot
+    prev_kpis = kpi_values(prev, filters) if prev is not None else None
+    history = kpi_history(snap, filters)
+    earlier = history_before(history, snap.loaded_at.date().isoformat())
+
+    # KPI trend directions: change since the previous data snapshot, or since
+    # the last stored day when this process has not seen an earlier one
+    trend = {
+        field: kpi_trend(
+            value,
+            getattr(prev_kpis, field) if prev_kpis is not None else earlier.get(field),
         )
-        oos_treemap.rename(
-            columns={"BalanceSupply_total": "BalanceSupply"}, inplace=True
+        for field, value in kpis._asdict().items()
+    }
+    spark = {
+        field: sparkline(values)
+        for field, values in (history.values if history else {}).items()
+    }
+
+    def card(title, field, value, **kwargs):
+        return kpi_card(
+            title, value, trend=trend[field], spark=spark.get(field), **kwargs
         )
-    else:
-        oos_group = pd.DataFrame(columns=["SKU", "Plant", "BalanceSupply_total", "TotalPlantInv", "OOS_Cases"])
-        oos_treemap = pd.DataFrame(columns=["SKU", "Plant", "Brand", "BalanceSupply", "TotalPlantInv", "OOS_Cases"])
-        total_oos_cases = 0
-
-    total_sku_10d = dff_filtered["SKU"].nunique()
-    bal_supply_sum = int(dff_filtered["BalanceSupply"].sum())
-    risk_count = int(dff_filtered["IsRisk"].sum())
-    bo_count = int(dff_filtered["IsBackorder"].sum())
-    low_cover = int(dff_filtered["IsLowCover"].sum())
-    oversell_count = int(dff_filtered["IsOversell"].sum())
-
-    # KPI trend directions (simple)
-    oos_trend = "up" if total_oos_cases > 0 else "flat"
-    risk_trend = "up" if risk_count > 0 else "flat"
-    bo_trend = "up" if bo_count > 0 else "flat"
-    oversell_trend = "up" if oversell_count > 0 else "flat"
-    bal_trend = "up" if bal_supply_sum > 0 else "flat"
 
     if view_mode == "executive":
         cards = [
-            kpi_card("SKUs 0–10 Days Cover", total_sku_10d, trend="flat"),
-            kpi_card("Balance Supply – Cases", f"{bal_supply_sum:,}", trend=bal_trend),
-            kpi_card(
+            card("SKUs 0–10 Days Cover", "skus", kpis.skus),
+            card(
+                "Balance Supply – Cases",
+                "balance_supply",
+                f"{kpis.balance_supply:,}",
+            ),
+            card(
                 "Total OOS Cases",
-                f"{total_oos_cases:,}",
+                "oos_cases",
+                f"{kpis.oos_cases:,}",
                 color="danger",
-                trend=oos_trend,
             ),
-            kpi_card(
-                "Supply Risk SKUs", risk_count, color="warning", trend=risk_trend
-            ),
-            kpi_card("Backorder SKUs", bo_count, color="danger", trend=bo_trend),
-            kpi_card("Oversell SKUs", oversell_count, color="info", trend=oversell_trend),
+            card("Supply Risk SKUs", "risk", kpis.risk, color="warning"),
+            card("Backorder SKUs", "backorder", kpis.backorder, color="danger"),
+            card("Oversell SKUs", "oversell", kpis.oversell, color="info"),
         ]
     else:
         cards = [
-            kpi_card("Total SKUs 0–10 Days Cover", total_sku_10d, trend="flat"),
-            kpi_card("Balance Supply – Cases", f"{bal_supply_sum:,}", trend=bal_trend),
-            kpi_card(
+            card("Total SKUs 0–10 Days Cover", "skus", kpis.skus),
+            card(
+                "Balance Supply – Cases",
+                "balance_supply",
+                f"{kpis.balance_supply:,}",
+            ),
+            card(
                 "Total OOS Cases",
-                f"{total_oos_cases:,}",
+                "oos_cases",
+                f"{kpis.oos_cases:,}",
                 color="danger",
-                trend=oos_trend,
-            ),
-            kpi_card("Total Supply Risk SKUs", risk_count, trend=risk_trend),
-            kpi_card("Total Backorder SKUs", bo_count, trend=bo_trend),
-            kpi_card("<10d Cover SKUs", low_cover, trend="flat"),
-            kpi_card(
-                "Oversell SKUs", oversell_count, color="info", trend=oversell_trend
             ),
+            card("Total Supply Risk SKUs", "risk", kpis.risk),
+            card("Total Backorder SKUs", "backorder", kpis.backorder),
+            card("<10d Cover SKUs", "low_cover", kpis.low_cover),
+            card("Oversell SKUs", "oversell", kpis.oversell, color="info"),
         ]
 
-    if view_mode == "executive":
-        info_columns = [
-            {"name": "Plant", "id": "Plant", "type": "text"},
-            {"name": "SKU", "id": "SKU", "type": "text"},
-            {"name": "Brand", "id": "Brand", "type": "text"},
-            {"name": "BusinessUnit", "id": "BusinessUnit", "type": "text"},
-            {"name": "Branch", "id": "Branch", "type": "text"},
-            {"name": "Class", "id": "Class", "type": "text"},
-            {"name": "OOS", "id": "OOS", "type": "text"},
-            {"name": "Risk", "id": "Risk", "type": "text"},
-            {
-                "name": "Balance Supply",
-                "id": "BalanceSupply",
-                "type": "numeric",
-                "format": Format(group=Group.yes, scheme=Scheme.fixed, precision=0),
-            },
-            {"name": "Upcoming Plan", "id": "UpcomingPlan", "type": "text"},
-            {"name": "Depletion Date", "id": "DepletionDate", "type": "text"},
-        ]
-    else:
-        info_columns = [
-            {"name": "Plant", "id": "Plant", "type": "text"},
-            {"name": "SKU", "id": "SKU", "type": "text"},
-            {"name": "Brand", "id": "Brand", "type": "text"},
-            {"name": "BusinessUnit", "id": "BusinessUnit", "type": "text"},
-            {"name": "Branch", "id": "Branch", "type": "text"},
-            {"name": "Class", "id": "Class", "type": "text"},
-            {"name": "Days<10", "id": "DaysLess10", "type": "text"},
-            {"name": "OOS", "id": "OOS", "type": "text"},
-            {
-                "name": "PlantInv %",
-                "id": "PlantInvPerc",
-                "type": "numeric",
-                "format": FormatTemplate.percentage(1),
-            },
-            {"name": "Oversell", "id": "Oversell", "type": "text"},
-            {"name": "Risk", "id": "Risk", "type": "text"},
-            {
-                "name": "MTD Sales",
-                "id": "MTD_Sales",
-                "type": "numeric",
-                "format": Format(group=Group.yes, scheme=Scheme.fixed, precision=0),
-            },
-            {
-                "name": "Forecast",
-                "id": "Forecast",
-                "type": "numeric",
-                "format": Format(group=Group.yes, scheme=Scheme.fixed, precision=0),
-            },
-            {
-                "name": "Avg 3M Sales",
-                "id": "Avg_3MNTH_sales",
-                "type": "numeric",
-                "format": Format(group=Group.yes, scheme=Scheme.fixed, precision=0),
-            },
-            {
-                "name": "Balance Supply",
-                "id": "BalanceSupply",
-                "type": "numeric",
-                "format": Format(group=Group.yes, scheme=Scheme.fixed, precision=0),
-            },
-            {"name": "Upcoming Plan", "id": "UpcomingPlan", "type": "text"},
-            {"name": "Depletion Date", "id": "DepletionDate", "type": "text"},
-        ]
+    last_refresh = "Last refresh: " + snap.loaded_at.strftime("%Y-%m-%d %H:%M:%S")
 
-    # date columns for table
-    dff_filtered["DepletionDate"] = dff_filtered["DepletionDate_parsed"].dt.date
-    dff_filtered["UpcomingPlan"] = dff_filtered["UpcomingPlan_parsed"].dt.date
-    info_data = dff_filtered[[c["id"] for c in info_columns]].to_dict("records")
-
-    def apply_theme(fig):
-        fig.update_layout(
-            template="plotly",
-            paper_bgcolor="#ffffff",
-            plot_bgcolor="#ffffff",
-            font_color="#263238",
-            font=dict(family='-apple-system, BlinkMacSystemFont, "SF Pro Text", "Segoe UI", system-ui, sans-serif'),
-        )
-        return fig
-
-    if not oos_treemap.empty:
-        dff_agg = oos_treemap.copy()
-        dff_agg["BalanceSupply"] = dff_agg["BalanceSupply"].clip(lower=0)
-        dff_agg["OOS_Cases"] = dff_agg["OOS_Cases"].fillna(0)
-
-        material_scale = [
-            [0.0, "#E8F5E9"],   # light green
-            [0.00001, "#C8E6C9"],
-            [0.25, "#FFF9C4"],  # soft yellow
-            [0.5, "#FFE082"],   # amber
-            [0.75, "#FFAB91"],  # orange
-            [1.0, "#E53935"],   # red
-        ]
+    return cards, last_refresh
 
-        fig_inv = px.treemap(
-            dff_agg,
-            path=["Brand", "Plant", "SKU"],
-            values="BalanceSupply",
-            color="OOS_Cases",
-            color_continuous_scale=material_scale,
-            custom_data=["BalanceSupply", "OOS_Cases", "TotalPlantInv"],
-        )
-        fig_inv.update_traces(
-            texttemplate="<b>%{label}</b><br>%{value:,.0f} cs",
-            hovertemplate=(
-                "<b>%{label}</b><br>"
-                "Balance Supply: %{customdata[0]:,.0f} cs<br>"
-                "OOS Gap: %{customdata[1]:,.0f} cs<br>"
-                "Plant Inventory: %{customdata[2]:,.0f} cs"
-                "<extra></extra>"
-            ),
-        )
-        fig_inv.update_layout(
-            title="Plant Inventory Overview",
-            margin=dict(t=40, l=10, r=10, b=10),
-            coloraxis_colorbar={"title": "OOS Gap (cs)"},
-        )
-    else:
-        fig_inv = go.Figure()
-        fig_inv.update_layout(
-            title="Plant Inventory Overview",
-            margin=dict(t=40, l=10, r=10, b=10),
-        )
-    fig_inv = apply_theme(fig_inv)
 
-    if not dff_filtered.empty:
+def next_focus(graph_id, click, focus, depth):
+    if dash.ctx.triggered_id != graph_id:
+        # filters or data changed: start again from the top
+        if focus == TREEMAP_ROOT:
+            raise PreventUpdate
+        return TREEMAP_ROOT
+    new_focus = treemap_focus(click, focus, depth)
+    if new_focus is None:
+        raise PreventUpdate
+    return new_focus
+
+
+@app.callback(
+    Output("plant-inv-focus", "data"),
+    Input("plant-inv-chart", "clickData"),
+    Input("data-version", "data"),
+    *FILTER_INPUTS,
+    State("plant-inv-focus", "data"),
+)
+def focus_plant_treemap(click, data_version, *args):
+    *filters, focus = args
+    return next_focus("plant-inv-chart", click, focus, depth=3)
+
+
+@app.callback(
+    Output("branch-treemap-focus", "data"),
+    Input("branch-oos-treemap", "clickData"),
+    Input("data-version", "data"),
+    *FILTER_INPUTS,
+    State("branch-treemap-focus", "data"),
+)
+def focus_branch_treemap(click, data_version, *args):
+    *filters, focus = args
+    return next_focus("branch-oos-treemap", click, focus, depth=3)
+
+
+@app.callback(
+    Output("plant-inv-chart", "figure"),
+    Output("oos-risk-bar", "figure"),
+    Input("tabs", "active_tab"),
+    Input("view-mode", "value"),
+    Input("plant-inv-focus", "data"),
+    Input("data-version", "data"),
+    *FILTER_INPUTS,
+)
+@shared_output("overview")
+def update_overview(active_tab, view_mode, focus, data_version, *filters):
+    if active_tab != "tab-overview":
+        raise PreventUpdate
+    snap = get_snapshot()
+    view = filtered_view(snap, filters)
+
+    dff_agg = view.oos_treemap.copy()
+    dff_agg["BalanceSupply"] = dff_agg["BalanceSupply"].clip(lower=0)
+    dff_agg["OOS_Cases"] = dff_agg["OOS_Cases"].fillna(0)
+    dff_agg["OOS_Total"] = dff_agg["OOS_Cases"]
+    dff_agg[["Brand", "Plant", "SKU"]] = dff_agg[["Brand", "Plant", "SKU"]].astype(str)
+    # children ranked by their total OOS gap, then by supply
+    nodes = treemap_lod(
+        dff_agg,
+        ["Brand", "Plant", "SKU"],
+        "BalanceSupply",
+        focus=focus,
+        rank=["OOS_Total", "BalanceSupply"],
+        weighted=["OOS_Cases"],
+        distinct=["TotalPlantInv"],
+        summed=["OOS_Total"],
+    )
+
+    fig_inv = Patch()
+    fig_inv["data"][0]["ids"] = nodes["id"].to_numpy()
+    fig_inv["data"][0]["labels"] = nodes["labels"].to_numpy()
+    fig_inv["data"][0]["parents"] = nodes["parent"].to_numpy()
+    fig_inv["data"][0]["values"] = nodes["BalanceSupply"].to_numpy()
+    fig_inv["data"][0]["marker"]["colors"] = nodes["OOS_Cases"].to_numpy()
+    # value and colour are in the hover already; only plant inventory rides along
+    fig_inv["data"][0]["customdata"] = nodes[["TotalPlantInv"]].to_numpy(dtype=object)
+    fig_inv["data"][0]["level"] = treemap_level(nodes, focus)
+
+    if len(view.rows):
         if view_mode == "executive":
             group_col = "BusinessUnit"
             title_bar = "OOS & Risk Exposure (Cases) by Business Unit"
@@ -1355,43 +3302,9 @@ def update_dashboard(
             group_col = "Brand"
             title_bar = "OOS & Risk Exposure (Cases) by Brand"
 
-        # allocate OOS_Cases from SKU+Plant to groups, proportional to BalanceSupply
-        if not oos_group.empty:
-            oos_join = dff_filtered.merge(
-                oos_group[["SKU", "Plant", "BalanceSupply_total", "OOS_Cases"]],
-                on=["SKU", "Plant"],
-                how="left",
-            )
-            oos_join["BalanceSupply_total"] = oos_join["BalanceSupply_total"].replace(0, np.nan)
-            oos_join["OOS_weight"] = (
-                oos_join["BalanceSupply"] / oos_join["BalanceSupply_total"]
-            )
-            oos_join["OOS_weight"] = oos_join["OOS_weight"].fillna(0)
-            oos_join["OOS_Cases_alloc"] = oos_join["OOS_weight"] * oos_join["OOS_Cases"]
-
-            oos_by_group = (
-                oos_join.groupby(group_col)["OOS_Cases_alloc"]
-                .sum()
-                .fillna(0)
-                .rename("OOS_Cases")
-            )
-        else:
-            oos_by_group = pd.Series(dtype=float, name="OOS_Cases")
-
+        # OOS gap allocated from SKU+Plant to groups, proportional to BalanceSupply;
         # risk cases = BalanceSupply on risk SKUs
-        risk_by_group = (
-            dff_filtered[dff_filtered["IsRisk"] == 1]
-            .groupby(group_col)["BalanceSupply"]
-            .sum()
-            .fillna(0)
-            .rename("Risk_Cases")
-        )
-
-        summary_df = (
-            pd.concat([oos_by_group, risk_by_group], axis=1)
-            .fillna(0)
-            .reset_index()
-        )
+        summary_df = gap_by_group(snap, view.rows, view.gap, group_col)
     else:
         summary_df = pd.DataFrame(
             columns=["Group", "OOS_Cases", "Risk_Cases"]
@@ -1399,158 +3312,189 @@ def update_dashboard(
         group_col = "Group"
         title_bar = "OOS & Risk Exposure"
 
-    fig_bar = go.Figure()
-    if not summary_df.empty:
-        fig_bar.add_bar(
-            name="OOS Gap (cs)",
-            x=summary_df[group_col],
-            y=summary_df["OOS_Cases"],
-            marker_color="#E53935",
-            text=[f"{v:,.0f}" for v in summary_df["OOS_Cases"]],
-            textposition="outside",
-            hovertemplate=(
-                "<b>%{x}</b><br>"
-                "OOS Gap: %{y:,.0f} cs"
-                "<extra></extra>"
-            ),
-        )
-        fig_bar.add_bar(
-            name="Risk Exposure (cs)",
-            x=summary_df[group_col],
-            y=summary_df["Risk_Cases"],
-            marker_color="#FB8C00",
-            text=[f"{v:,.0f}" for v in summary_df["Risk_Cases"]],
-            textposition="outside",
-            hovertemplate=(
-                "<b>%{x}</b><br>"
-                "Risk Exposure: %{y:,.0f} cs"
-                "<extra></extra>"
-            ),
-        )
-    fig_bar.update_layout(
-        barmode="group",
-        title=title_bar,
-        margin=dict(t=60, b=130, l=10, r=10),
-        xaxis_tickangle=-30,
-        legend=dict(
-            orientation="h",
-            yanchor="bottom",
-            y=1.02,
-            xanchor="right",
-            x=1,
-        ),
-    )
-    fig_bar = apply_theme(fig_bar)
+    fig_bar = Patch()
+    for i, col in enumerate(["OOS_Cases", "Risk_Cases"]):
+        fig_bar["data"][i]["x"] = summary_df[group_col].to_numpy()
+        fig_bar["data"][i]["y"] = summary_df[col].to_numpy()
+        fig_bar["data"][i]["text"] = [f"{v:,.0f}" for v in summary_df[col]]
+    fig_bar["layout"]["title"]["text"] = title_bar
+
+    return fig_inv, fig_bar
+
+
+@app.callback(
+    Output("branch-oos-treemap", "figure"),
+    Input("tabs", "active_tab"),
+    Input("branch-treemap-focus", "data"),
+    Input("data-version", "data"),
+    *FILTER_INPUTS,
+)
+@shared_output("branch-treemap")
+def update_branch_treemap(active_tab, focus, data_version, *filters):
+    if active_tab != "tab-treemap":
+        raise PreventUpdate
+    snap = get_snapshot()
+    view = filtered_view(snap, filters)
+    dff_filtered = view.dff
 
     treemap_df = (
-        dff_filtered.groupby(["Branch", "Brand", "SKU"])["BalanceSupply"]
+        dff_filtered.groupby(["Branch", "Brand", "SKU"], observed=True)["BalanceSupply"]
         .sum()
         .reset_index(name="BalanceSupply")
     )
-    if not treemap_df.empty:
-        fig_treemap = px.treemap(
-            treemap_df,
-            path=["Branch", "Brand", "SKU"],
-            values="BalanceSupply",
-            color="Branch",
-            hover_data=["SKU", "BalanceSupply"],
-        )
-        fig_treemap.update_traces(
-            hovertemplate=(
-                "<b>%{label}</b><br>"
-                "SKU: %{customdata[0]}<br>"
-                "Balance Supply: %{customdata[1]:,} cs"
-                "<extra></extra>"
-            )
-        )
-        fig_treemap.update_layout(margin=dict(t=40, l=10, r=10, b=10))
-    else:
-        fig_treemap = go.Figure()
-        fig_treemap.update_layout(margin=dict(t=40, l=10, r=10, b=10))
-    fig_treemap = apply_theme(fig_treemap)
+    treemap_df[["Branch", "Brand", "SKU"]] = treemap_df[["Branch", "Brand", "SKU"]].astype(str)
+    nodes = treemap_lod(
+        treemap_df,
+        ["Branch", "Brand", "SKU"],
+        "BalanceSupply",
+        focus=focus,
+        distinct=["SKU"],
+    )
+    branches = snap.df_full["Branch"].cat.categories
+    color_of = {
+        b: BRANCH_COLORS[i % len(BRANCH_COLORS)] for i, b in enumerate(branches)
+    }
+
+    fig_treemap = Patch()
+    fig_treemap["data"][0]["ids"] = nodes["id"].to_numpy()
+    fig_treemap["data"][0]["labels"] = nodes["labels"].to_numpy()
+    fig_treemap["data"][0]["parents"] = nodes["parent"].to_numpy()
+    fig_treemap["data"][0]["values"] = nodes["BalanceSupply"].to_numpy()
+    fig_treemap["data"][0]["marker"]["colors"] = (
+        nodes["top"].map(color_of).fillna(OTHER_COLOR).to_numpy()
+    )
+    fig_treemap["data"][0]["customdata"] = nodes[["SKU"]].to_numpy(dtype=object)
+    fig_treemap["data"][0]["level"] = treemap_level(nodes, focus)
+
+    return fig_treemap
+
+
+@app.callback(
+    Output("info-table", "columns"),
+    Output("info-table", "data"),
+    Output("info-table", "page_count"),
+    Output("info-table", "page_current"),
+    Input("tabs", "active_tab"),
+    Input("view-mode", "value"),
+    Input("info-table", "page_current"),
+    Input("info-table", "page_size"),
+    Input("info-table", "sort_by"),
+    Input("info-table", "filter_query"),
+    Input("data-version", "data"),
+    *FILTER_INPUTS,
+)
+@shared_output("info-table")
+def update_info_table(
+    active_tab,
+    view_mode,
+    page_current,
+    page_size,
+    sort_by,
+    filter_query,
+    data_version,
+    *filters,
+):
+    if active_tab != "tab-info":
+        raise PreventUpdate
+    snap = get_snapshot()
+    columns = info_columns(view_mode)
+    rows = info_table_rows(snap, filters, sort_by, filter_query)
+
+    # only the current page goes to the browser
+    page_size = page_size or INFO_PAGE_SIZE
+    page_count = max(1, -(-len(rows) // page_size))
+    page = min(page_current or 0, page_count - 1)
+    page_rows = rows[page * page_size:(page + 1) * page_size]
+
+    return columns, info_records(snap, page_rows, columns), page_count, page
+
+
+@app.callback(
+    Output("crit-table", "columns"),
+    Output("crit-table", "data"),
+    Output("crit-table", "style_data_conditional"),
+    Output("crit-table", "page_count"),
+    Output("crit-table", "page_current"),
+    Output("crit-col-page", "max_value"),
+    Output("crit-col-page", "active_page"),
+    Input("tabs", "active_tab"),
+    Input("crit-table", "page_current"),
+    Input("crit-table", "page_size"),
+    Input("crit-table", "sort_by"),
+    Input("crit-table", "filter_query"),
+    Input("crit-col-page", "active_page"),
+    Input("data-version", "data"),
+    *FILTER_INPUTS,
+)
+@shared_output("crit-table")
+def update_crit_table(
+    active_tab,
+    page_current,
+    page_size,
+    sort_by,
+    filter_query,
+    col_page,
+    data_version,
+    *filters,
+):
+    if active_tab != "tab-crit":
+        raise PreventUpdate
+    snap = get_snapshot()
 
     crit_columns = []
     crit_data = []
     style_data_conditional = []
+    page_count, page, window_count, window_page = 1, 0, 1, 1
 
     try:
-        if not dff_filtered.empty and not df_crit.empty:
-            crit_filtered = df_crit.copy()
-            base_cols = ["AI_SKU", "AI_MFGBRND"]
-
-            valid_skus = set(dff_filtered["SKU"].astype(str).unique())
-            valid_brands = set(dff_filtered["Brand"].astype(str).unique())
-            branch_set = set(dff_filtered["Branch"].unique())
-
-            # filter rows (SKUs / Brands)
-            if valid_skus:
-                crit_filtered = crit_filtered[
-                    crit_filtered["AI_SKU"].astype(str).isin(valid_skus)
-                ]
-            if valid_brands:
-                crit_filtered = crit_filtered[
-                    crit_filtered["AI_MFGBRND"].astype(str).str.upper().isin(valid_brands)
-                ]
-
-            # branch columns = intersection of crit sheet columns and filtered branches
-            branch_set = set(dff_filtered["Branch"].unique())
-            branch_cols = [
-                c for c in crit_filtered.columns if c not in base_cols and c in branch_set
-            ]
-
-            if branch_cols:
-                for col in branch_cols:
-                    crit_filtered[col] = (
-                        pd.to_numeric(crit_filtered[col], errors="coerce")
-                        .round(0)
-                        .astype("Int64")
-                    )
-
-                final_cols = base_cols + branch_cols
-                crit_filtered = crit_filtered[final_cols]
-                crit_filtered = crit_filtered.replace({np.nan: None})
-
-                crit_columns = [{"name": c, "id": c} for c in final_cols]
-                crit_data = crit_filtered.to_dict("records")
-
-                # bands: 0 = deep red, 1–2 dark red, 3–4 bright red, 5–6 light red, 7–8 pale green, 9–10 green, >10 dark green
-                bands = [
-                    (0, 0, "#B71C1C", "white"),
-                    (1, 2, "#D32F2F", "white"),
-                    (3, 4, "#F44336", "white"),
-                    (5, 6, "#FFCDD2", "#212121"),
-                    (7, 8, "#FFFDE7", "#212121"),
-                    (9, 10, "#C8E6C9", "#212121"),
-                    (11, 9999, "#2E7D32", "white"),
-                ]
-                for col in branch_cols:
-                    for low, high, bg, font in bands:
-                        style_data_conditional.append(
-                            {
-                                "if": {
-                                    "column_id": col,
-                                    "filter_query": f"{{{col}}} >= {low} && {{{col}}} <= {high}",
-                                },
-                                "backgroundColor": bg,
-                                "color": font,
-                            }
-                        )
-                    style_data_conditional.append(
-                        {
-                            "if": {
-                                "column_id": col,
-                                "filter_query": f"{{{col}}} is blank",
-                            },
-                            "backgroundColor": "#ECEFF1",
-                            "color": "#90A4AE",
-                        }
-                    )
+        rows, branch_cols = crit_table_rows(snap, filters, sort_by, filter_query)
+        if len(branch_cols):
+            # rows are paged by the table, branch columns by the column pager
+            page_size = page_size or CRIT_PAGE_SIZE
+            page_count = max(1, -(-len(rows) // page_size))
+            page = min(page_current or 0, page_count - 1)
+            window_count = -(-len(branch_cols) // CRIT_COLUMN_WINDOW)
+            window_page = min(max(col_page or 1, 1), window_count)
+            start = (window_page - 1) * CRIT_COLUMN_WINDOW
+            window = branch_cols[start:start + CRIT_COLUMN_WINDOW]
+
+            final_cols = CRIT_BASE_COLUMNS + snap.crit.branches[window].tolist()
+            page_rows = rows[page * page_size:(page + 1) * page_size]
+            crit_columns = [{"name": c, "id": c} for c in final_cols]
+            crit_data = crit_records(snap.crit, page_rows, window)
+            style_data_conditional = crit_page_styles(snap.crit, page_rows, window)
     except Exception as e:
         print("CRIT TABLE ERROR:", e)
         crit_columns = []
         crit_data = []
         style_data_conditional = []
 
+    return (
+        crit_columns,
+        crit_data,
+        style_data_conditional,
+        page_count,
+        page,
+        window_count,
+        window_page,
+    )
+
+
+@app.callback(
+    Output("inter-rotation-map", "figure"),
+    Input("tabs", "active_tab"),
+    Input("data-version", "data"),
+    *FILTER_INPUTS,
+)
+@shared_output("inter-map")
+def update_inter_map(active_tab, data_version, *filters):
+    if active_tab != "tab-inter":
+        raise PreventUpdate
+    snap = get_snapshot()
+    view = filtered_view(snap, filters)
+    dff_filtered = view.dff
+    df_coord = snap.df_coord
+
     if not dff_filtered.empty:
         unique_skus = dff_filtered["SKU"].nunique()
     else:
@@ -1559,8 +3503,8 @@ def update_dashboard(
     if unique_skus == 1:
         sku_sel = dff_filtered["SKU"].unique()[0]
 
-        # donor branches from InterRotation
-        df_inter = explode_interrotation(dff_filtered[dff_filtered["SKU"] == sku_sel])
+        # donor branches from InterRotation (every filtered row is this SKU)
+        df_inter = inter_rotation_rows(snap, cached_rows(snap, filters))
 
         if not df_inter.empty:
             df_inter = df_inter.merge(
@@ -1618,12 +3562,22 @@ def update_dashboard(
 
             # edges from each donor to each OOS
             if not donors.empty and not targets.empty:
-                edge_lats = []
-                edge_lons = []
-                for _, drow in donors.iterrows():
-                    for _, trow in targets.iterrows():
-                        edge_lats += [drow["Latitude"], trow["Latitude"], None]
-                        edge_lons += [drow["Longitude"], trow["Longitude"], None]
+                # keyed on donors so the weights line up row for row
+                donor_keys = ["Branch", "Latitude", "Longitude"]
+                donor_cases = donors[donor_keys].merge(
+                    df_inter.groupby(
+                        donor_keys, as_index=False, observed=True, dropna=False
+                    )["Cases"].sum(),
+                    on=donor_keys,
+                    how="left",
+                )["Cases"]
+                edge_lats, edge_lons = inter_edges(
+                    donors["Latitude"],
+                    donors["Longitude"],
+                    targets["Latitude"],
+                    targets["Longitude"],
+                    d_cases=donor_cases.to_numpy(),
+                )
 
                 fig_inter.add_trace(
                     go.Scattermapbox(
@@ -1656,7 +3610,7 @@ def update_dashboard(
             )
     else:
         # default bubble map view
-        df_inter = explode_interrotation(dff_filtered)
+        df_inter = inter_rotation_rows(snap, cached_rows(snap, filters))
         if not df_inter.empty:
             df_map = df_inter.merge(
                 df_coord, left_on="Branch", right_on="AI_BRANCH", how="left"
@@ -1698,33 +3652,27 @@ def update_dashboard(
 
     fig_inter = apply_theme(fig_inter)
 
-    last_refresh = "Last refresh: " + datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    return fig_inter
 
-    return (
-        cards,
-        fig_inv,
-        fig_bar,
-        fig_treemap,
-        info_columns,
-        info_data,
-        crit_columns,
-        crit_data,
-        style_data_conditional,
-        fig_inter,
-        last_refresh,
-    )
 
 @app.callback(
     Output("crit-download", "data"),
     Input("crit-export-btn", "n_clicks"),
-    State("crit-table", "data"),
+    State("crit-table", "sort_by"),
+    State("crit-table", "filter_query"),
+    *[State(i.component_id, i.component_property) for i in FILTER_INPUTS],
     prevent_initial_call=True,
 )
-def export_criticality(n_clicks, rows):
-    if not n_clicks or not rows:
+def export_criticality(n_clicks, sort_by, filter_query, *filters):
+    # every row and branch column, not just the page on screen
+    if not n_clicks:
+        return dash.no_update
+    snap = get_snapshot()
+    rows, branch_cols = crit_table_rows(snap, filters, sort_by, filter_query)
+    if not len(rows) or not len(branch_cols):
         return dash.no_update
 
-    df = pd.DataFrame(rows)
+    df = pd.DataFrame(crit_records(snap.crit, rows, branch_cols))
 
     def to_xlsx(bytes_io):
         with pd.ExcelWriter(bytes_io, engine="xlsxwriter") as writer:
@@ -1736,14 +3684,22 @@ def export_criticality(n_clicks, rows):
 @app.callback(
     Output("info-download", "data"),
     Input("info-export-btn", "n_clicks"),
-    State("info-table", "data"),
+    State("view-mode", "value"),
+    State("info-table", "sort_by"),
+    State("info-table", "filter_query"),
+    *[State(i.component_id, i.component_property) for i in FILTER_INPUTS],
     prevent_initial_call=True,
 )
-def export_information(n_clicks, rows):
-    if not n_clicks or not rows:
+def export_information(n_clicks, view_mode, sort_by, filter_query, *filters):
+    # the table only holds one page; export every row it would show
+    if not n_clicks:
+        return dash.no_update
+    snap = get_snapshot()
+    rows = info_table_rows(snap, filters, sort_by, filter_query)
+    if not len(rows):
         return dash.no_update
 
-    df = pd.DataFrame(rows)
+    df = pd.DataFrame(info_records(snap, rows, info_columns(view_mode)))
 
     def to_xlsx(bytes_io):
         with pd.ExcelWriter(bytes_io, engine="xlsxwriter") as writer:
@@ -1800,4 +3756,8 @@ def _risk_count(v):
 
 
 if __name__ == "__main__":
-    app.run(port=SERVER_PORT, debug=True, host="0.0.0.0")
+    if "--compile-cache" in sys.argv:
+        # e.g. run after dropping in a new workbook, before restarting workers
+        print("Cache written to", compile_cache())
+    else:
+        app.run(port=SERVER_PORT, debug=True, host="0.0.0.0")
@@ -0,0 +1,957 @@
+"""Benchmarks for the dashboard data layer.
+
+Run one benchmark by name, optionally with a row count:
+
+    python benchmarks.py startup 500000
+"""
+
+import gc
+import json
+import multiprocessing
+import os
+import sys
+import tempfile
+import time
+
+import numpy as np
+import pandas as pd
+import plotly
+import plotly.express as px
+import plotly.graph_objects as go
+
+import app
+
+
+def timed(fn, *args, repeat=1, **kwargs):
+    best = None
+    result = None
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        result = fn(*args, **kwargs)
+        elapsed = time.perf_counter() - t0
+        best = elapsed if best is None else min(best, elapsed)
+    return best, result
+
+
+def synthetic_branches(n=40):
+    return [f"BRANCH {i:03d}" for i in range(n)]
+
+
+def synthetic_skus(n=2000):
+    return [f"{i:04d} SKU {i % 97} CAN 250MLX24" for i in range(n)]
+
+
+def synthetic_summary(rows, n_skus=2000, n_branches=40, seed=0):
+    rng = np.random.default_rng(seed)
+    skus = np.array(synthetic_skus(n_skus))
+    branches = np.array(synthetic_branches(n_branches))
+    brands = np.array([f"BRAND {i:02d}" for i in range(60)])
+    plants = np.array(["ASDI", "AJPL", "AUJN", "ADJI"])
+    bus = np.array(["KSA", "GCC", "OMAN", "EXPORT"])
+    classes = np.array(["Class A", "Class B", "Class C"])
+    yes_no = np.array(["Yes", "No"])
+    dates = pd.date_range("2025-01-01", periods=365).strftime("%d-%b-%Y").to_numpy()
+
+    sku_idx = rng.integers(0, n_skus, rows)
+    inter = np.array(
+        [
+            ", ".join(
+                f"{b} ({c} CS)"
+                for b, c in zip(
+                    rng.choice(branches, 3, replace=False), rng.integers(1, 5000, 3)
+                )
+            )
+            for _ in range(500)
+        ]
+        + [""] * 500
+    )
+    return pd.DataFrame(
+        {
+            "Plant": plants[rng.integers(0, len(plants), rows)],
+            "AI_SKU": skus[sku_idx],
+            "AI_MFGBRND": brands[sku_idx % len(brands)],
+            "AI_BUSINESSUNIT": bus[sku_idx % len(bus)],
+            "AI_BRANCH": branches[rng.integers(0, n_branches, rows)],
+            "Class": classes[sku_idx % len(classes)],
+            "<10_Days": yes_no[rng.integers(0, 2, rows)],
+            "OOS": np.where(rng.random(rows) < 0.1, "OOS", ""),
+            "PlantInv %": (rng.random(rows) * 100).round(2).astype(str),
+            "Upcoming_Plan": dates[rng.integers(0, len(dates), rows)],
+            "Depletion_Date": dates[rng.integers(0, len(dates), rows)],
+            "Risk": np.where(rng.random(rows) < 0.2, "Risk", "No Risk"),
+            "BackOrder?": yes_no[rng.integers(0, 2, rows)],
+            "Oversell": yes_no[rng.integers(0, 2, rows)],
+            "MTD Sales": rng.integers(0, 20000, rows),
+            "Forecast": rng.integers(0, 200000, rows),
+            "Avg_3MNTH_sales": rng.integers(0, 20000, rows),
+            "Inter_Rotation_Branches": inter[rng.integers(0, len(inter), rows)],
+            "Balance_Supply": rng.integers(-5000, 150000, rows),
+            "Total_SKU_Plant_Inventory": rng.integers(0, 200000, rows),
+        }
+    )
+
+
+def synthetic_criticality(n_skus=2000, n_branches=40, seed=0):
+    rng = np.random.default_rng(seed)
+    values = rng.integers(0, 30, (n_skus, n_branches)).astype(float)
+    values[rng.random(values.shape) < 0.3] = np.nan
+    df = pd.DataFrame(values, columns=synthetic_branches(n_branches))
+    df.insert(0, "AI_MFGBRND", [f"BRAND {i % 60:02d}" for i in range(n_skus)])
+    df.insert(0, "AI_SKU", synthetic_skus(n_skus))
+    return df
+
+
+def synthetic_coordinates(n_branches=40, seed=0):
+    rng = np.random.default_rng(seed)
+    return pd.DataFrame(
+        {
+            "AI_BRANCH": synthetic_branches(n_branches),
+            "Country": "KSA",
+            "Latitude": rng.uniform(17, 30, n_branches),
+            "Longitude": rng.uniform(38, 55, n_branches),
+        }
+    )
+
+
+def write_synthetic_workbook(path, rows):
+    with pd.ExcelWriter(path, engine="xlsxwriter") as writer:
+        synthetic_summary(rows).to_excel(
+            writer, index=False, sheet_name=app.SUMMARY_SHEET
+        )
+        synthetic_criticality().to_excel(
+            writer, index=False, sheet_name=app.CRIT_SHEET
+        )
+        synthetic_coordinates().to_excel(
+            writer, index=False, sheet_name=app.COORD_SHEET
+        )
+    return path
+
+
+def bench_startup(rows=500_000):
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "workbook.xlsx")
+        cache_dir = os.path.join(tmp, "cache")
+
+        t_write, _ = timed(write_synthetic_workbook, path, rows)
+        print(f"synthetic workbook: {rows:,} rows written in {t_write:.1f}s")
+
+        version = app.file_hash(path)
+        t_excel, frames = timed(app.load_frames, path)
+        t_compile, _ = timed(app.write_frame_cache, version, frames, cache_dir, path)
+        t_cache, _ = timed(app.read_frame_cache, version, cache_dir, path, repeat=3)
+
+        print(f"excel load:      {t_excel:8.2f}s")
+        print(f"cache compile:   {t_compile:8.2f}s")
+        print(f"cache load:      {t_cache:8.2f}s  ({t_excel / t_cache:.0f}x faster)")
+
+
+def synthetic_depletion_dates(rows, seed=0):
+    rng = np.random.default_rng(seed)
+    days = pd.date_range("2024-01-01", periods=730)
+    pool = np.concatenate(
+        [
+            days.strftime("%d-%b-%Y"),
+            days.strftime("%d-%b-%y"),
+            days[:365].strftime("%d-%b"),
+            days.strftime("%Y-%m-%d"),
+            days.strftime("%d/%m/%Y"),
+            days.strftime("%d-%m-%Y"),
+            ["", "TBC"],
+        ]
+    )
+    return pd.Series(pool[rng.integers(0, len(pool), rows)], dtype=object)
+
+
+def bench_dates(rows=1_000_000):
+    values = synthetic_depletion_dates(rows)
+    print(f"{rows:,} depletion dates, {values.nunique():,} distinct strings")
+
+    t_new, new = timed(app.parse_depletion_dates, values, repeat=3)
+    t_old, old = timed(values.apply, app.parse_depletion_date)
+    assert new.equals(old)
+
+    print(f"per-row apply:   {t_old:8.2f}s")
+    print(f"vectorised:      {t_new:8.2f}s  ({t_old / t_new:.0f}x faster)")
+
+
+def bench_memory(rows=1_000_000):
+    raw = synthetic_summary(rows).astype(str)
+    before = app.prepare_summary(raw)
+    after, _ = app.apply_schema(before, synthetic_coordinates())
+
+    report = app.memory_report(before, after)
+    report[["bytes_before", "bytes_after"]] /= 1e6
+    pd.set_option("display.width", 120)
+    print(f"df_full, {rows:,} rows (MB)")
+    print(report.rename(columns={"bytes_before": "MB_before", "bytes_after": "MB_after"}).round(1))
+
+
+def synthetic_snapshot(rows, n_skus=2000, n_branches=40):
+    df_full = app.prepare_summary(synthetic_summary(rows, n_skus, n_branches).astype(str))
+    df_coord = synthetic_coordinates(n_branches)
+    df_full, df_coord = app.apply_schema(df_full, df_coord)
+    df_crit = app.prepare_criticality(synthetic_criticality(n_skus, n_branches))
+    frames = (df_full, df_crit, df_coord)
+    return app.snapshot_from_frames(frames, version=f"synthetic-{rows}")
+
+
+def pandas_filters(
+    df,
+    brands,
+    plants,
+    branches,
+    classes,
+    busunits,
+    ai_skus,
+    branch_dc,
+    oversell,
+    risk,
+    global_search,
+):
+    # the chained-mask apply_filters used before the filter index (no DC bands)
+    df = df.copy()
+    for col, values in [
+        ("Brand", brands),
+        ("Plant", plants),
+        ("Branch", branches),
+        ("Class", classes),
+        ("BusinessUnit", busunits),
+        ("SKU", ai_skus),
+    ]:
+        if values:
+            df = df[df[col].isin(values)]
+    if oversell:
+        df = df[df["IsOversell"].isin([1 if v == "Yes" else 0 for v in oversell])]
+    if risk:
+        df = df[df["IsRisk"].isin([1 if v == "Yes" else 0 for v in risk])]
+    if global_search:
+        mask = pd.Series(False, index=df.index)
+        for col in ["SKU", "Brand", "BusinessUnit", "Branch", "Plant", "Class"]:
+            mask |= df[col].astype(str).str.lower().str.contains(global_search)
+        df = df[mask]
+    return df
+
+
+FILTER_STATES = {
+    "default view": [None] * 10,
+    "one brand": [["BRAND 07"]] + [None] * 9,
+    "brand+branch+risk": [["BRAND 07", "BRAND 11"], None, ["BRANCH 003"]]
+    + [None] * 5
+    + [["Yes"], None],
+    "20 skus": [None] * 5 + [synthetic_skus()[:20]] + [None] * 4,
+    "global search": [None] * 9 + ["sku 4"],
+}
+
+
+def bench_filters(rows=1_000_000):
+    snap = synthetic_snapshot(rows)
+    print(f"{rows:,} rows")
+    for name, state in FILTER_STATES.items():
+        t_old, old = timed(pandas_filters, snap.df_full, *state, repeat=3)
+        t_new, new = timed(app.apply_filters, snap, *state, repeat=3)
+        assert old.index.equals(new.index)
+        print(
+            f"{name:20s} chained masks {t_old * 1e3:8.1f} ms"
+            f"   index {t_new * 1e3:8.1f} ms   ({len(new):,} rows)"
+        )
+
+
+def six_pass_facets(snap, state):
+    # what update_filter_options did before facet_counts
+    return {
+        dim: sorted(app.apply_filters(snap, *state, ignore={dim})[col].unique())
+        for dim, col in app.FILTER_DIMENSIONS.items()
+    }
+
+
+def one_pass_facets(snap, state):
+    return app.facet_counts(snap, app.filter_masks(snap, *state))
+
+
+def bench_facets(rows=1_000_000):
+    snap = synthetic_snapshot(rows)
+    print(f"{rows:,} rows")
+    for name, state in FILTER_STATES.items():
+        t_old, old = timed(six_pass_facets, snap, state, repeat=3)
+        t_new, new = timed(one_pass_facets, snap, state, repeat=3)
+        assert all(
+            list(old[dim]) == list(snap.index[dim].values[new[dim] > 0]) for dim in old
+        )
+        print(
+            f"{name:20s} six passes {t_old * 1e3:8.1f} ms"
+            f"   one pass {t_new * 1e3:8.1f} ms"
+        )
+
+
+def bench_search(n_skus=100_000):
+    values = pd.Index(sorted(synthetic_skus(n_skus)))
+    t_build, search = timed(app.build_search_index, values)
+    counts = np.ones(len(values), dtype=np.int64)
+    allowed = counts > 0
+    print(f"{n_skus:,} SKUs, index built in {t_build * 1e3:.0f} ms")
+
+    for text in ["0", "0042", "9999", "sku 4", "250mlx24", "no such sku"]:
+        t_search, codes = timed(app.search_codes, search, text, allowed, repeat=20)
+        t_opts, _ = timed(app.option_list, values, counts, codes, repeat=20)
+        print(
+            f"{text!r:16s} {len(codes):3d} matches   search {t_search * 1e3:6.2f} ms"
+            f"   options {t_opts * 1e3:6.2f} ms"
+        )
+
+
+def category_regex_search(snap, query):
+    # global search as evaluated before the trigram index
+    gs = query.strip().lower()
+    mask = np.zeros(len(snap.df_full), dtype=bool)
+    for dim in app.SEARCH_DIMENSIONS:
+        postings = snap.index[dim]
+        hits = postings.values.astype(str).str.lower().str.contains(gs)
+        mask |= app.postings_mask(postings, np.flatnonzero(hits))
+    return mask
+
+
+def bench_global_search(rows=1_000_000):
+    snap = synthetic_snapshot(rows, n_skus=20_000, n_branches=300)
+    n_values = sum(len(snap.index[d].values) for d in app.SEARCH_DIMENSIONS)
+    print(f"{rows:,} rows, {n_values:,} distinct searchable values")
+
+    for query in ["1234 sku", "brand 07", "branch 12", "250ml", "ks", "no match"]:
+        t_lookup, codes = timed(app.text_search, snap.text, query, repeat=20)
+        t_rows, masks = timed(app.filter_masks, snap, *[None] * 9, query, repeat=5)
+        t_old, old = timed(category_regex_search, snap, query, repeat=5)
+        assert (old == masks["global"]).all()
+        print(
+            f"{query!r:12s} lookup {t_lookup * 1e3:6.2f} ms   rows {t_rows * 1e3:6.2f} ms"
+            f"   (str.contains on values {t_old * 1e3:6.1f} ms)"
+            f"   {masks['global'].sum():,} rows"
+        )
+
+
+# callback arguments ahead of *filters for a first render of each tab:
+# (active_tab, [view_mode,] [focus | page, page_size, sort_by, filter_query,
+# [col_page]], data_version)
+OVERVIEW_ARGS = ("tab-overview", "analyst", None, None)
+TREEMAP_ARGS = ("tab-treemap", None, None)
+INFO_ARGS = ("tab-info", "analyst", 0, None, None, None, None)
+CRIT_ARGS = ("tab-crit", 0, None, None, None, None, None)
+INTER_ARGS = ("tab-inter", None)
+
+
+def bench_tabs(rows=200_000):
+    snap = synthetic_snapshot(rows)
+    # serve the synthetic data through the callbacks' own get_snapshot()
+    app._snapshot = snap._replace(signature=app.file_signature(app.FILE_PATH))
+    filters = [None, ["ASDI"], None, None, None, None, None, None, None, None]
+    tabs = [
+        ("overview", app.update_overview, OVERVIEW_ARGS),
+        ("treemap", app.update_branch_treemap, TREEMAP_ARGS),
+        ("info", app.update_info_table, INFO_ARGS),
+        ("crit", app.update_crit_table, CRIT_ARGS),
+        ("inter", app.update_inter_map, INTER_ARGS),
+    ]
+
+    app.clear_results()
+    t_view, _ = timed(app.filtered_view, snap, tuple(filters))
+    t_kpis, _ = timed(app.update_kpis, "analyst", None, *filters, repeat=3)
+    print(f"{rows:,} rows: filtered view {t_view * 1e3:.1f} ms, kpis {t_kpis * 1e3:.1f} ms")
+
+    times = {}
+    for name, fn, args in tabs:
+        times[name], _ = timed(fn, *args, *filters, repeat=3)
+        print(f"  {name:9s} {times[name] * 1e3:8.1f} ms")
+    shared = t_view + t_kpis
+    print(
+        f"filter change: all outputs {(shared + sum(times.values())) * 1e3:.1f} ms,"
+        f" kpis + overview tab {(shared + times['overview']) * 1e3:.1f} ms"
+    )
+
+
+def bench_result_cache(rows=1_000_000):
+    snap = synthetic_snapshot(rows)
+    states = [
+        [None] * 10,
+        [None, ["ASDI"], None, None, None, None, None, None, None, None],
+        [None, ["ASDI", "AJPL"], None, ["Class A"], None, None, None, None, ["Risk"], None],
+    ]
+    lookups = [
+        ("rows", lambda f: app.cached_rows(snap, f)),
+        ("facets", lambda f: app.cached_result(
+            "facets", snap, f, lambda: app.facet_counts(snap, app.filter_masks(snap, *f))
+        )),
+        ("view", lambda f: app.filtered_view(snap, f)),
+    ]
+    print(f"{rows:,} rows")
+    for filters in states:
+        app.clear_results()
+        active = sum(1 for v in filters if v)
+        for name, lookup in lookups:
+            t_miss, _ = timed(lookup, filters)
+            # the same state in another order hits the same entry
+            shuffled = [list(reversed(v)) if v else v for v in filters]
+            t_hit, _ = timed(lookup, shuffled, repeat=20)
+            print(
+                f"  {active} filters  {name:6s} miss {t_miss * 1e3:8.2f} ms"
+                f"   hit {t_hit * 1e6:6.1f} us"
+            )
+    print(app.result_cache_stats())
+
+
+def bench_shared_cache(rows=200_000):
+    snap = synthetic_snapshot(rows)
+    app._snapshot = snap._replace(signature=app.file_signature(app.FILE_PATH))
+    filters = [None, ["ASDI"], None, None, None, None, None, None, None, None]
+    renders = [
+        ("kpis", app.update_kpis, ("analyst", None)),
+        ("overview", app.update_overview, OVERVIEW_ARGS),
+        ("treemap", app.update_branch_treemap, TREEMAP_ARGS),
+        ("info", app.update_info_table, INFO_ARGS),
+        ("crit", app.update_crit_table, CRIT_ARGS),
+        ("inter", app.update_inter_map, INTER_ARGS),
+    ]
+
+    with tempfile.TemporaryDirectory() as tmp:
+        app.SHARED_CACHE_PATH = os.path.join(tmp, "results.db")
+        print(f"{rows:,} rows")
+        for name, fn, args in renders:
+            app.clear_results()
+            t_render, result = timed(fn, *args, *filters)
+            t_put, _ = timed(app.shared_put, name, snap.version, result)
+            t_get, _ = timed(app.shared_get, name, repeat=5)
+            print(
+                f"  {name:9s} render {t_render * 1e3:8.1f} ms"
+                f"   shared put {t_put * 1e3:6.1f} ms   get {t_get * 1e3:6.1f} ms"
+            )
+        print(" ", app.shared_cache_stats())
+
+
+def process_memory():
+    # kB for the calling process; PSS splits shared pages between sharers
+    fields = {}
+    with open("/proc/self/smaps_rollup") as f:
+        for line in f:
+            parts = line.split()
+            if len(parts) == 3 and parts[2] == "kB":
+                fields[parts[0].rstrip(":")] = int(parts[1])
+    return {
+        "rss": fields["Rss"],
+        "pss": fields["Pss"],
+        "uss": fields["Private_Clean"] + fields["Private_Dirty"],
+    }
+
+
+def preload_worker(snap, rows, barrier, results):
+    if snap is None:
+        snap = synthetic_snapshot(rows)
+    barrier.wait()  # everyone is loaded, measure together
+    loaded = process_memory()
+    # a few requests' worth of filtering and facets
+    for filters in FILTER_STATES.values():
+        app.filtered_view(snap, filters)
+        app.facet_counts(snap, app.filter_masks(snap, *filters))
+    barrier.wait()
+    results.put((loaded, process_memory()))
+    barrier.wait()
+
+
+def worker_memory(snap, rows, workers):
+    ctx = multiprocessing.get_context("fork")
+    barrier = ctx.Barrier(workers)
+    results = ctx.Queue()
+    procs = [
+        ctx.Process(target=preload_worker, args=(snap, rows, barrier, results))
+        for _ in range(workers)
+    ]
+    for p in procs:
+        p.start()
+    stats = [results.get() for _ in procs]
+    for p in procs:
+        p.join()
+    return [
+        {k: sum(s[i][k] for s in stats) / len(stats) / 1024 for k in stats[0][i]}
+        for i in range(2)
+    ]
+
+
+def bench_preload(rows=300_000, workers=4):
+    print(f"{rows:,} rows, per-worker memory in MB (mean)")
+    for preload in (False, True):
+        snap = None
+        if preload:
+            # what gunicorn.conf.py does in the master
+            snap = synthetic_snapshot(rows)
+            gc.collect()
+            gc.freeze()
+        for n in sorted({1, 2, workers}):
+            loaded, served = worker_memory(snap, rows, n)
+            print(
+                f"  {'preload' if preload else 'per-worker load':15s} {n} workers"
+                f"   rss {loaded['rss']:6.1f}   pss {loaded['pss']:6.1f}"
+                f"   private {loaded['uss']:6.1f}"
+                f"   (after requests: private {served['uss']:6.1f})"
+            )
+        gc.unfreeze()
+
+
+def bench_info_table(rows=1_000_000):
+    snap = synthetic_snapshot(rows)
+    app._snapshot = snap._replace(signature=app.file_signature(app.FILE_PATH))
+    columns = app.info_columns("analyst")
+    print(f"{rows:,} rows")
+    cases = [
+        ("default view", [None] * 10, [], ""),
+        ("sort by balance", [None] * 10, [{"column_id": "BalanceSupply", "direction": "desc"}], ""),
+        ("sku contains", [None] * 10, [], '{SKU} icontains "sku 4"'),
+        (
+            "plant + sort + filter",
+            [None, ["ASDI"], None, None, None, None, None, None, None, None],
+            [{"column_id": "DepletionDate", "direction": "asc"}],
+            "{MTD_Sales} > 10000",
+        ),
+    ]
+    for name, filters, sort_by, query in cases:
+        app.clear_results()
+        t_page, out = timed(
+            app.update_info_table,
+            "tab-info", "analyst", 3, 15, sort_by, query, None, *filters,
+        )
+        page_bytes = len(json.dumps(out[1], default=str))
+        print(
+            f"  {name:22s} page {t_page * 1e3:7.1f} ms  {page_bytes:7,} bytes"
+            f"   ({out[2]:,} pages)"
+        )
+
+    # before: every filtered row was serialised on each update
+    t_all, records = timed(
+        app.info_records, snap, app.cached_rows(snap, [None] * 10), columns
+    )
+    all_bytes = len(json.dumps(records, default=str))
+    print(f"  all rows to the browser {t_all * 1e3:7.1f} ms  {all_bytes / 2**20:.1f} MB")
+
+
+def baseline_crit_table(dff, df_crit):
+    # the crit table callback before server-side paging: every row and
+    # branch column, converted and styled on each update
+    crit = df_crit.copy()
+    crit = crit[crit["AI_SKU"].astype(str).isin(set(dff["SKU"].astype(str).unique()))]
+    crit = crit[
+        crit["AI_MFGBRND"].astype(str).str.upper().isin(set(dff["Brand"].astype(str).unique()))
+    ]
+    branch_set = set(dff["Branch"].unique())
+    branch_cols = [c for c in crit.columns if c not in app.CRIT_BASE_COLUMNS and c in branch_set]
+    for col in branch_cols:
+        crit[col] = pd.to_numeric(crit[col], errors="coerce").round(0).astype("Int64")
+    crit = crit[app.CRIT_BASE_COLUMNS + branch_cols].replace({np.nan: None})
+    styles = [
+        {"if": {"column_id": col, "filter_query": f"{{{col}}} >= 0"}}
+        for col in branch_cols
+        for _ in range(8)
+    ]
+    return crit.to_dict("records"), styles
+
+
+def bench_crit_table(n_skus=50_000, n_branches=300, rows=500_000):
+    snap = synthetic_snapshot(rows, n_skus=n_skus, n_branches=n_branches)
+    app._snapshot = snap._replace(signature=app.file_signature(app.FILE_PATH))
+    print(f"{n_skus:,} SKUs x {n_branches} branches, {rows:,} summary rows")
+    cases = [
+        ("default view", [None] * 10, [], ""),
+        ("one plant", [None, ["ASDI"]] + [None] * 8, [], ""),
+        (
+            "sorted + filtered",
+            [None] * 10,
+            [{"column_id": "BRANCH 007", "direction": "asc"}],
+            "{BRANCH 007} < 3",
+        ),
+    ]
+    for name, filters, sort_by, query in cases:
+        app.clear_results()
+        t_page, out = timed(
+            app.update_crit_table, "tab-crit", 2, 15, sort_by, query, 3, None, *filters
+        )
+        page_bytes = len(json.dumps(out[:3], default=str))
+        print(
+            f"  {name:18s} page {t_page * 1e3:7.1f} ms  {page_bytes:8,} bytes"
+            f"  {len(out[2]):4d} style rules"
+            f"   ({out[3]:,} row pages x {out[5]} column windows)"
+        )
+
+    dff = app.filtered_view(snap, [None] * 10).dff
+    t_old, (records, styles) = timed(baseline_crit_table, dff, snap.df_crit)
+    old_bytes = len(json.dumps([records, styles], default=str))
+    print(f"  before: whole matrix {t_old * 1e3:7.1f} ms  {old_bytes / 2**20:.1f} MB")
+
+
+def pandas_crit_selection(snap, rows):
+    # SKU / brand / branch selection on the df_crit frame (string isin)
+    df_full, df_crit = snap.df_full, snap.df_crit
+    skus = set(df_full["SKU"].iloc[rows].astype(str).unique())
+    brands = set(df_full["Brand"].iloc[rows].astype(str).unique())
+    branches = set(df_full["Branch"].iloc[rows].unique())
+    crit = df_crit[
+        df_crit["AI_SKU"].astype(str).isin(skus)
+        & df_crit["AI_MFGBRND"].astype(str).str.upper().isin(brands)
+    ]
+    cols = [c for c in crit.columns if c not in app.CRIT_BASE_COLUMNS and c in branches]
+    return crit[cols].to_numpy()
+
+
+def matrix_crit_selection(snap, filters):
+    rows, cols = app.crit_table_rows(snap, filters, [], "")
+    return snap.crit.values[np.ix_(rows, cols)]
+
+
+def bench_crit_matrix(n_skus=50_000, n_branches=300, rows=500_000):
+    snap = synthetic_snapshot(rows, n_skus=n_skus, n_branches=n_branches)
+    print(f"{n_skus:,} SKUs x {n_branches} branches, {rows:,} summary rows")
+    states = {
+        "default view": [None] * 10,
+        "one brand": [["BRAND 07"]] + [None] * 9,
+        "one plant": [None, ["ASDI"]] + [None] * 8,
+        "brand+branch+risk": FILTER_STATES["brand+branch+risk"],
+    }
+    for name, filters in states.items():
+        filter_rows = app.cached_rows(snap, filters)
+        t_old, old = timed(pandas_crit_selection, snap, filter_rows, repeat=3)
+
+        def fresh():
+            app.clear_results()
+            app.cached_rows(snap, filters)  # row filtering is timed elsewhere
+            t, result = timed(matrix_crit_selection, snap, filters)
+            return t, result
+
+        t_new, new = min((fresh() for _ in range(3)), key=lambda r: r[0])
+        assert np.array_equal(old, new, equal_nan=True)
+        print(
+            f"  {name:18s} {new.shape[0]:6,} x {new.shape[1]:3d}"
+            f"   frame isin {t_old * 1e3:7.1f} ms   matrix {t_new * 1e3:6.1f} ms"
+        )
+
+
+def bench_inter_rotation(rows=200_000):
+    snap = synthetic_snapshot(rows)
+    t_build, inter = timed(app.build_inter_rotation, snap.df_full["InterRotation"])
+    print(f"{rows:,} rows: parsed at load in {t_build * 1e3:.1f} ms, {len(inter):,} donor entries")
+    for name, filters in FILTER_STATES.items():
+        filter_rows = app.cached_rows(snap, filters)
+        t_new, new = timed(app.inter_rotation_rows, snap, filter_rows, repeat=3)
+        t_old, old = timed(app.explode_interrotation, snap.df_full.iloc[filter_rows])
+        assert len(old) == len(new)
+        print(
+            f"  {name:18s} {len(filter_rows):8,} rows   iterrows {t_old * 1e3:9.1f} ms"
+            f"   table {t_new * 1e3:6.1f} ms"
+        )
+
+
+def nested_edges(donors, targets):
+    # the edge loop before vectorisation
+    edge_lats = []
+    edge_lons = []
+    for _, drow in donors.iterrows():
+        for _, trow in targets.iterrows():
+            edge_lats += [drow["Latitude"], trow["Latitude"], None]
+            edge_lons += [drow["Longitude"], trow["Longitude"], None]
+    return edge_lats, edge_lons
+
+
+def bench_inter_edges():
+    rng = np.random.default_rng(0)
+    for n_donors, n_targets in [(10, 10), (50, 50), (200, 200)]:
+        donors = synthetic_coordinates(n_donors, seed=1)
+        targets = synthetic_coordinates(n_targets, seed=2)
+        cases = rng.integers(1, 5000, n_donors)
+        args = (
+            donors["Latitude"],
+            donors["Longitude"],
+            targets["Latitude"],
+            targets["Longitude"],
+        )
+        t_old, (old_lats, _) = timed(nested_edges, donors, targets)
+        t_all, (lats, _) = timed(app.inter_edges, *args, limit=None, repeat=5)
+        assert np.array_equal(np.array(old_lats, dtype=float), lats, equal_nan=True)
+        t_km, _ = timed(app.inter_edges, *args, rank="distance", repeat=5)
+        t_cases, _ = timed(app.inter_edges, *args, d_cases=cases, rank="cases", repeat=5)
+        print(
+            f"{n_donors:4d} donors x {n_targets:4d} OOS ({n_donors * n_targets:6,} edges)"
+            f"   iterrows {t_old * 1e3:8.1f} ms   numpy {t_all * 1e3:6.2f} ms"
+            f"   capped by distance {t_km * 1e3:6.2f} ms / cases {t_cases * 1e3:6.2f} ms"
+        )
+
+
+def merged_oos_gap(dff, group_col):
+    # the SKU x Plant gap and its allocation as update_dashboard built them
+    dff = dff.copy()
+    dff["BalanceSupply"] = dff["BalanceSupply"].astype(float)
+    dff["Total_SKU_Plant_Inventory"] = dff["Total_SKU_Plant_Inventory"].astype(float)
+    oos_group = dff.groupby(["SKU", "Plant"], as_index=False, observed=True).agg(
+        BalanceSupply_total=("BalanceSupply", "sum"),
+        TotalPlantInv=("Total_SKU_Plant_Inventory", "max"),
+    )
+    oos_group["OOS_Cases"] = (
+        oos_group["BalanceSupply_total"] - oos_group["TotalPlantInv"]
+    ).clip(lower=0)
+    total = int(oos_group["OOS_Cases"].sum())
+    treemap = oos_group.merge(
+        dff[["SKU", "Plant", "Brand"]].drop_duplicates(), on=["SKU", "Plant"], how="left"
+    )
+    oos_join = dff.merge(
+        oos_group[["SKU", "Plant", "BalanceSupply_total", "OOS_Cases"]],
+        on=["SKU", "Plant"],
+        how="left",
+    )
+    oos_join["BalanceSupply_total"] = oos_join["BalanceSupply_total"].replace(0, np.nan)
+    oos_join["OOS_Cases_alloc"] = (
+        oos_join["BalanceSupply"] / oos_join["BalanceSupply_total"]
+    ).fillna(0) * oos_join["OOS_Cases"]
+    by_group = oos_join.groupby(group_col, observed=True)["OOS_Cases_alloc"].sum()
+    return total, treemap, by_group
+
+
+def cube_oos_gap(snap, rows, group_col):
+    gap = app.oos_gap(snap.oos, rows)
+    return int(gap.oos.sum()), gap, app.gap_by_group(snap, rows, gap, group_col)
+
+
+def bench_oos_cube(rows=1_000_000):
+    snap = synthetic_snapshot(rows)
+    print(f"{rows:,} rows")
+    t_build, _ = timed(app.build_oos_cube, snap.df_full)
+    print(f"{'cube build (per load)':28s} {t_build * 1e3:8.1f} ms")
+    for name, state in FILTER_STATES.items():
+        filter_rows = app.filter_rows(snap, *state)
+        dff = snap.df_full.iloc[filter_rows]
+        t_old, (old_total, _, old_groups) = timed(merged_oos_gap, dff, "Brand", repeat=3)
+        t_new, (new_total, _, new_groups) = timed(
+            cube_oos_gap, snap, filter_rows, "Brand", repeat=3
+        )
+        assert old_total == new_total
+        assert np.allclose(old_groups.to_numpy(), new_groups["OOS_Cases"].to_numpy())
+        print(
+            f"{name:28s} groupby+merges {t_old * 1e3:8.1f} ms"
+            f"   cube {t_new * 1e3:7.1f} ms   ({len(filter_rows):,} rows)"
+        )
+
+
+def frame_kpis(snap, state):
+    # the per-column reductions update_kpis ran over the filtered frame
+    dff = app.apply_filters(snap, *state).copy()
+    for col in ("BalanceSupply", "Total_SKU_Plant_Inventory"):
+        dff[col] = pd.to_numeric(dff[col], errors="coerce").fillna(0).astype(float)
+    oos, _, _ = merged_oos_gap(dff, "Brand")
+    return app.Kpis(
+        skus=dff["SKU"].nunique(),
+        balance_supply=int(dff["BalanceSupply"].sum()),
+        oos_cases=oos,
+        risk=int(dff["IsRisk"].sum()),
+        backorder=int(dff["IsBackorder"].sum()),
+        low_cover=int(dff["IsLowCover"].sum()),
+        oversell=int(dff["IsOversell"].sum()),
+    )
+
+
+def bench_kpis(rows=1_000_000):
+    snap = synthetic_snapshot(rows)
+    print(f"{rows:,} rows")
+    for name, state in FILTER_STATES.items():
+        filter_rows = app.filter_rows(snap, *state)
+        t_old, old = timed(frame_kpis, snap, state, repeat=3)
+        t_new, new = timed(app.compute_kpis, snap, filter_rows, repeat=3)
+        assert old == new
+        print(
+            f"{name:20s} frame reductions {t_old * 1e3:8.1f} ms"
+            f"   fused {t_new * 1e3:7.1f} ms   ({len(filter_rows):,} rows)"
+        )
+
+
+def bench_kpi_history(rows=200_000, days=365):
+    snap = synthetic_snapshot(rows)
+    brands = sorted(snap.df_full["Brand"].cat.categories)[:3]
+    states = {
+        "default view": [None] * 10,
+        "three brands": [brands] + [None] * 9,
+        "brands+branch": [brands, None, ["BRANCH 003"]] + [None] * 7,
+    }
+    with tempfile.TemporaryDirectory() as tmp:
+        app.KPI_HISTORY_PATH = os.path.join(tmp, "kpi_history.db")
+        start = snap.loaded_at - pd.Timedelta(days=days - 1)
+        t_record = []
+        for day in range(days):
+            past = snap._replace(
+                version=f"day-{day}", loaded_at=start + pd.Timedelta(days=day)
+            )
+            t, _ = timed(app.record_kpi_history, past)
+            t_record.append(t)
+        size = os.path.getsize(app.KPI_HISTORY_PATH)
+        (groups,) = app.kpi_history_db().execute(
+            "SELECT COUNT(*) FROM kpi_history WHERE day = ?",
+            (snap.loaded_at.date().isoformat(),),
+        ).fetchone()
+        print(
+            f"{rows:,} rows, {groups:,} groups/day, {days} days:"
+            f" record {np.median(t_record) * 1e3:.1f} ms/load,"
+            f" {size / 2**20:.1f} MB on disk"
+        )
+        t_live, _ = timed(app.compute_kpis, snap, np.arange(rows), repeat=3)
+        for window in (30, days):
+            since = (snap.loaded_at.date() - pd.Timedelta(days=window - 1)).isoformat()
+            for name, state in states.items():
+                t_read, history = timed(app.read_kpi_history, state, since, repeat=3)
+                print(
+                    f"  {window:3d}-day series {name:14s} {t_read * 1e3:7.1f} ms"
+                    f"   ({len(history.days)} points; one live KPI pass per day"
+                    f" ~{t_live * window:.1f} s)"
+                )
+
+
+def px_overview_figures(snap, view, view_mode):
+    # plant-inv-chart and oos-risk-bar as whole figures, the way they were built
+    dff_agg = view.oos_treemap.copy()
+    dff_agg["BalanceSupply"] = dff_agg["BalanceSupply"].clip(lower=0)
+    dff_agg[["Brand", "Plant", "SKU"]] = dff_agg[["Brand", "Plant", "SKU"]].astype(str)
+    fig_inv = px.treemap(
+        dff_agg,
+        path=["Brand", "Plant", "SKU"],
+        values="BalanceSupply",
+        color="OOS_Cases",
+        color_continuous_scale=app.OOS_COLOR_SCALE,
+        custom_data=["BalanceSupply", "OOS_Cases", "TotalPlantInv"],
+    )
+    fig_inv.update_traces(
+        texttemplate=app.PLANT_TREEMAP_FIGURE.data[0].texttemplate,
+        hovertemplate=app.PLANT_TREEMAP_FIGURE.data[0].hovertemplate,
+    )
+    fig_inv.update_layout(
+        title="Plant Inventory Overview",
+        margin=dict(t=40, l=10, r=10, b=10),
+        coloraxis_colorbar={"title": "OOS Gap (cs)"},
+    )
+    fig_inv = app.apply_theme(fig_inv)
+
+    group_col = "BusinessUnit" if view_mode == "executive" else "Brand"
+    summary_df = app.gap_by_group(snap, view.rows, view.gap, group_col)
+    fig_bar = go.Figure(app.OOS_BAR_FIGURE)
+    for trace, col in zip(fig_bar.data, ["OOS_Cases", "Risk_Cases"]):
+        trace.update(
+            x=summary_df[group_col],
+            y=summary_df[col],
+            text=[f"{v:,.0f}" for v in summary_df[col]],
+        )
+    fig_bar.update_layout(title=f"OOS & Risk Exposure (Cases) by {group_col}")
+    return fig_inv, fig_bar
+
+
+def px_branch_treemap(view):
+    treemap_df = (
+        view.dff.groupby(["Branch", "Brand", "SKU"], observed=True)["BalanceSupply"]
+        .sum()
+        .reset_index(name="BalanceSupply")
+    )
+    treemap_df[["Branch", "Brand", "SKU"]] = treemap_df[["Branch", "Brand", "SKU"]].astype(str)
+    fig = px.treemap(
+        treemap_df,
+        path=["Branch", "Brand", "SKU"],
+        values="BalanceSupply",
+        color="Branch",
+        hover_data=["SKU", "BalanceSupply"],
+    )
+    fig.update_traces(hovertemplate=app.BRANCH_TREEMAP_FIGURE.data[0].hovertemplate)
+    fig.update_layout(margin=dict(t=40, l=10, r=10, b=10))
+    return app.apply_theme(fig)
+
+
+def response_bytes(*outputs):
+    return sum(
+        len(json.dumps(out, cls=plotly.utils.PlotlyJSONEncoder)) for out in outputs
+    )
+
+
+def bench_figures(rows=200_000):
+    snap = synthetic_snapshot(rows)
+    app._snapshot = snap._replace(signature=app.file_signature(app.FILE_PATH))
+    states = {
+        "one brand": [["BRAND 07"]] + [None] * 9,
+        "brand+branch+risk": FILTER_STATES["brand+branch+risk"],
+        "20 skus": FILTER_STATES["20 skus"],
+    }
+    print(f"{rows:,} rows")
+    for name, state in states.items():
+        view = app.filtered_view(snap, state)
+        t_old, old = timed(px_overview_figures, snap, view, "analyst", repeat=3)
+        t_new, new = timed(
+            app.update_overview, "tab-overview", "analyst", None, None, *state, repeat=3
+        )
+        print(
+            f"  overview {name:18s} px figures {t_old * 1e3:7.1f} ms"
+            f" {response_bytes(*old) / 1024:8.1f} KiB"
+            f"   patch {t_new * 1e3:7.1f} ms {response_bytes(*new) / 1024:8.1f} KiB"
+        )
+        t_old, old = timed(px_branch_treemap, view, repeat=3)
+        t_new, new = timed(
+            app.update_branch_treemap, "tab-treemap", None, None, *state, repeat=3
+        )
+        print(
+            f"  treemap  {name:18s} px figure  {t_old * 1e3:7.1f} ms"
+            f" {response_bytes(old) / 1024:8.1f} KiB"
+            f"   patch {t_new * 1e3:7.1f} ms {response_bytes(new) / 1024:8.1f} KiB"
+        )
+
+
+def bench_treemap_lod(rows=500_000):
+    for n_skus in (2_000, 20_000, 100_000):
+        snap = synthetic_snapshot(rows, n_skus=n_skus)
+        app._snapshot = snap._replace(signature=app.file_signature(app.FILE_PATH))
+        app.clear_results()
+        state = [None] * 10
+        app.filtered_view(snap, state)
+        print(f"{rows:,} rows, {n_skus:,} SKUs")
+        for top_n in (0, app.TREEMAP_TOP_N):
+            app.TREEMAP_TOP_N = top_n
+            label = f"top {top_n}" if top_n else "all nodes"
+            t_inv, (inv, _) = timed(
+                app.update_overview, "tab-overview", "analyst", None, None, *state
+            )
+            t_tm, tm = timed(app.update_branch_treemap, "tab-treemap", None, None, *state)
+            nodes = [
+                len(op["params"]["value"])
+                for fig in (inv, tm)
+                for op in fig.to_plotly_json()["operations"]
+                if op["location"] == ["data", 0, "ids"]
+            ]
+            print(
+                f"  {label:9s} plant treemap {nodes[0]:7,} nodes {t_inv * 1e3:7.1f} ms"
+                f" {response_bytes(inv) / 1024:8.1f} KiB"
+                f"   branch treemap {nodes[1]:7,} nodes {t_tm * 1e3:7.1f} ms"
+                f" {response_bytes(tm) / 1024:8.1f} KiB"
+            )
+
+
+BENCHMARKS = {
+    "startup": bench_startup,
+    "dates": bench_dates,
+    "memory": bench_memory,
+    "filters": bench_filters,
+    "facets": bench_facets,
+    "search": bench_search,
+    "global-search": bench_global_search,
+    "tabs": bench_tabs,
+    "result-cache": bench_result_cache,
+    "shared-cache": bench_shared_cache,
+    "preload": bench_preload,
+    "info-table": bench_info_table,
+    "crit-table": bench_crit_table,
+    "crit-matrix": bench_crit_matrix,
+    "inter-rotation": bench_inter_rotation,
+    "inter-edges": bench_inter_edges,
+    "oos-cube": bench_oos_cube,
+    "kpis": bench_kpis,
+    "kpi-history": bench_kpi_history,
+    "figures": bench_figures,
+    "treemap-lod": bench_treemap_lod,
+}
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2 or sys.argv[1] not in BENCHMARKS:
+        print("usage: python benchmarks.py {%s} [rows]" % "|".join(BENCHMARKS))
+        sys.exit(1)
+    args = [int(a) for a in sys.argv[2:]]
+    BENCHMARKS[sys.argv[1]](*args)
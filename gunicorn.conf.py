@@ -0,0 +1,14 @@
+import gc
+
+# Load app.py (and the data snapshot it builds at import) once in the master,
+# then fork the workers.  The snapshot's NumPy buffers are never written, so
+# the forked workers keep sharing those pages instead of each holding a copy.
+preload_app = True
+
+
+def when_ready(server):
+    # runs in the master after the preload, before any worker is forked:
+    # move everything allocated so far out of the collector's reach so that
+    # collections in the workers do not write to (and un-share) those pages
+    gc.collect()
+    gc.freeze()